@@ -9,6 +9,20 @@ import asyncio
 import json
 import logging
 import threading
+import concurrent.futures
+import sqlite3
+import sys
+import marshal
+import struct
+import zlib
+import time
+import tempfile
+import collections
+import bisect
+import itertools
+import gzip
+import hashlib
+import io
 from typing import Optional, cast
 from dotenv import load_dotenv
 from flask import Flask
@@ -26,7 +40,24 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class InkGameBot(commands.Bot):
+    async def setup_hook(self):
+        # Данные читаются один раз при запуске: on_ready повторяется при каждом переподключении,
+        # и повторная загрузка затерла бы изменения, еще не записанные PersistenceWriter
+        load_data()
+        
+        # Кнопки лидерборда работают и на сообщениях, отправленных до перезапуска
+        self.add_view(LeaderboardView())
+
+    async def close(self):
+        # Доводим очередь регистраций и лидерборды, дописываем отложенные сохранения и бэкапы перед выключением
+        await REGISTRATIONS.close()
+        await LEADERBOARDS.close()
+        await PERSISTENCE.close()
+        await BACKUPS.close()
+        await super().close()
+
+bot = InkGameBot(command_prefix='!', intents=intents)
 
 # ==================== СИСТЕМА ЯЗЫКОВ ====================
 
@@ -239,6 +270,7 @@ DEFAULT_CONFIG = {
     'min_number': 1,
     'max_number': 456,
     'registration_role_name': 'Зарегистрирован',
+    'registration_role_id': None,  # ID роли - находится и после переименования
     'used_numbers': set(),
     'registered_players': set(),
     'player_numbers': {},
@@ -257,6 +289,9 @@ DEFAULT_CONFIG = {
 
 # Глобальная структура данных
 GUILD_DATA = {}
+# Данные старого формата (один сервер), ждущие on_ready: до загрузки список серверов еще пуст.
+# Пока они не перенесены, запись на диск отключена - иначе файл затрется пустым состоянием
+LEGACY_DATA = {}
 
 # Доступные титулы
 AVAILABLE_TITLES = {
@@ -287,51 +322,1861 @@ PRIZES = {
 DISCORD_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 UNBELIEVABOAT_TOKEN = os.getenv('UNBELIEVABOAT_TOKEN')
 
-def get_guild_config(guild_id: int, guild_name: str = "Unknown Server") -> dict:
+# Хранение данных: json - весь файл целиком, journal - снапшот + журнал изменений,
+# sharded - отдельный файл на каждый сервер, sqlite - база SQLite
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'json').lower()
+DATA_FILE = 'game_data.json'
+JOURNAL_FILE = 'game_data.journal'
+SHARD_DIR = os.getenv('SHARD_DIR', 'game_data')
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'game_data.db')
+# Через сколько записей журнала делать новый снапшот
+JOURNAL_COMPACT_EVERY = int(os.getenv('JOURNAL_COMPACT_EVERY', '500'))
+# Формат снапшота для json/journal: json или binary (быстрый запуск; JSON остается для бэкапов)
+SNAPSHOT_FORMAT = os.getenv('SNAPSHOT_FORMAT', 'json').lower()
+BINARY_SNAPSHOT_MAGIC = b'INKG'
+BINARY_SNAPSHOT_VERSION = 1
+# Сигнатура, версия формата, версия marshal, длина данных, CRC32
+BINARY_SNAPSHOT_HEADER = struct.Struct('>4sHHQI')
+# Окно (в секундах), за которое запросы на сохранение объединяются в одну запись
+PERSIST_WINDOW = float(os.getenv('PERSIST_WINDOW', '0.5'))
+# Бэкапы: полный базовый бэкап, затем дельты к нему; после стольких дельт - новая база
+BACKUP_BASE_EVERY = int(os.getenv('BACKUP_BASE_EVERY', '20'))
+# Не чаще одного автоматического бэкапа на сервер за столько секунд
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', '60'))
+# Не чаще одного автоматического обновления лидерборда на сервер за столько секунд
+LEADERBOARD_INTERVAL = float(os.getenv('LEADERBOARD_INTERVAL', '5'))
+# Кэш готовых embed'ов: сколько серверов держать и через сколько секунд без обращений забывать
+RENDER_CACHE_GUILDS = int(os.getenv('RENDER_CACHE_GUILDS', '500'))
+RENDER_CACHE_TTL = float(os.getenv('RENDER_CACHE_TTL', '900'))
+# Очередь регистраций: сколько игроков за пачку и пауза между запросами к Discord (роль/ник)
+REG_BATCH_SIZE = int(os.getenv('REG_BATCH_SIZE', '25'))
+REG_APPLY_DELAY = float(os.getenv('REG_APPLY_DELAY', '0.2'))
+# Быстрый ответ на /reg: номер показывается одним запросом, без предварительного defer
+REG_FAST_ACK = os.getenv('REG_FAST_ACK', 'false').lower() in ('1', 'true', 'yes')
+# Сколько секунд быстрый /reg ждет блокировку сервера, прежде чем отправить defer
+REG_ACK_LOCK_WAIT = float(os.getenv('REG_ACK_LOCK_WAIT', '0.5'))
+# Массовый импорт (/import_players): сколько участников обрабатывается параллельно
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', '4'))
+# Сжимать файлы бэкапов gzip (.json.gz); /restore принимает оба вида
+BACKUP_COMPRESS = os.getenv('BACKUP_COMPRESS', 'false').lower() in ('1', 'true', 'yes')
+
+def _int_keys(mapping: dict, field: str) -> dict:
+    """Приводит ключи-ID пользователей к int (после JSON они становятся строками)"""
+    result = {}
+    for user_id, value in mapping.items():
+        try:
+            result[int(user_id)] = value
+        except (ValueError, TypeError):
+            logger.warning(f"⚠️ Неверный user_id в {field}: {user_id}")
+    return result
+
+# Счетчик версий состояний серверов (GuildState.version)
+STATE_VERSIONS = itertools.count(1)
+
+# Число единичных битов в каждом значении байта
+_POPCOUNT = bytes(bin(value).count('1') for value in range(256))
+
+class NumberPool:
+    """Занятые номера как битовая карта (bytearray) со счетчиком
+
+    Ведет себя как множество (add, discard, in, len, итерация по возрастанию) и
+    отвечает на запросы по диапазону, не перебирая весь диапазон: free_count, next_free.
+    В JSON сохраняется списком, в бинарном снапшоте - самой битовой картой.
+    """
+
+    __slots__ = ('_bits', '_count')
+    __hash__ = None
+
+    _NOT_FULL = re.compile(rb'[^\xff]')
+    _NOT_EMPTY = re.compile(rb'[^\x00]')
+
+    def __init__(self, numbers=()):
+        self._bits = bytearray()
+        self._count = 0
+        for number in numbers:
+            self.add(number)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'NumberPool':
+        pool = cls()
+        pool._bits = bytearray(data)
+        pool._count = sum(pool._bits.translate(_POPCOUNT))
+        return pool
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits.rstrip(b'\x00'))
+
+    def add(self, number: int):
+        if number < 0:
+            raise ValueError(f"номер не может быть отрицательным: {number}")
+        index = number >> 3
+        if index >= len(self._bits):
+            self._bits.extend(bytes(index + 1 - len(self._bits)))
+        mask = 1 << (number & 7)
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._count += 1
+
+    def discard(self, number: int):
+        if number in self:
+            self._bits[number >> 3] &= ~(1 << (number & 7)) & 0xff
+            self._count -= 1
+
+    def remove(self, number: int):
+        if number not in self:
+            raise KeyError(number)
+        self.discard(number)
+
+    def clear(self):
+        self._bits = bytearray()
+        self._count = 0
+
+    def is_used(self, number: int) -> bool:
+        return number in self
+
+    def __contains__(self, number) -> bool:
+        if not isinstance(number, int) or number < 0 or number >> 3 >= len(self._bits):
+            return False
+        return bool(self._bits[number >> 3] & (1 << (number & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        bits = self._bits
+        for match in self._NOT_EMPTY.finditer(bits):
+            index = match.start()
+            value = bits[index]
+            for bit in range(8):
+                if value >> bit & 1:
+                    yield (index << 3) + bit
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, NumberPool):
+            return self._count == other._count and self.to_bytes() == other.to_bytes()
+        if isinstance(other, (set, frozenset)):
+            return self._count == len(other) and all(number in self for number in other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"NumberPool({list(self)})"
+
+    def count_range(self, low: int, high: int) -> int:
+        """Сколько номеров занято в [low, high]"""
+        low = max(low, 0)
+        high = min(high, len(self._bits) * 8 - 1)
+        if low > high:
+            return 0
+        first, last = low >> 3, high >> 3
+        first_mask = (0xff << (low & 7)) & 0xff
+        last_mask = 0xff >> (7 - (high & 7))
+        if first == last:
+            return _POPCOUNT[self._bits[first] & first_mask & last_mask]
+        return (
+            _POPCOUNT[self._bits[first] & first_mask]
+            + sum(self._bits[first + 1:last].translate(_POPCOUNT))
+            + _POPCOUNT[self._bits[last] & last_mask]
+        )
+
+    def free_count(self, low: int, high: int) -> int:
+        """Сколько номеров свободно в [low, high]; считаются только края вне диапазона"""
+        if low > high:
+            return 0
+        outside = self.count_range(0, low - 1) + self.count_range(high + 1, len(self._bits) * 8 - 1)
+        return (high - low + 1) - (self._count - outside)
+
+    def next_free(self, low: int, high: int, limit: int, start: Optional[int] = None) -> list:
+        """Первые limit свободных номеров в [low, high], начиная со start; полностью занятые байты пропускаются"""
+        result = []
+        number = max(low, 0) if start is None else max(low, start, 0)
+        bits = self._bits
+        while number <= high and len(result) < limit:
+            index = number >> 3
+            if index >= len(bits):
+                # Дальше карты все номера свободны
+                result.extend(range(number, min(high, number + limit - len(result) - 1) + 1))
+                break
+            if bits[index] == 0xff:
+                match = self._NOT_FULL.search(bits, index + 1)
+                number = (match.start() if match else len(bits)) << 3
+                continue
+            if not bits[index] >> (number & 7) & 1:
+                result.append(number)
+            number += 1
+        return result
+
+class NumberAllocator:
+    """Свободные номера диапазона как лениво перемешиваемый массив (Фишер-Йетс с обменом)
+
+    Позиции [0, free) виртуального массива - свободные номера, остальные заняты.
+    Хранятся только позиции, отличные от исходных, поэтому память растет с числом
+    операций, а не с размером диапазона. Выдача, освобождение и бронь - O(1).
+    """
+
+    __slots__ = ('min_number', 'size', 'free', '_slot', '_position')
+
+    def __init__(self, min_number: int, max_number: int, used=()):
+        self.min_number = min_number
+        self.size = max(0, max_number - min_number + 1)
+        self.free = self.size
+        self._slot = {}
+        self._position = {}
+        for number in used:
+            self.reserve(number)
+
+    def _swap(self, i: int, j: int):
+        value_i = self._slot.get(i, i)
+        value_j = self._slot.get(j, j)
+        self._slot[i], self._slot[j] = value_j, value_i
+        self._position[value_j], self._position[value_i] = i, j
+
+    def allocate(self) -> Optional[int]:
+        """Случайный свободный номер; None - свободных нет"""
+        if self.free == 0:
+            return None
+        index = random.randrange(self.free)
+        self.free -= 1
+        self._swap(index, self.free)
+        return self.min_number + self._slot.get(self.free, self.free)
+
+    def reserve(self, number: int) -> bool:
+        """Занимает конкретный номер; False - он занят или вне диапазона"""
+        value = number - self.min_number
+        if not 0 <= value < self.size:
+            return False
+        position = self._position.get(value, value)
+        if position >= self.free:
+            return False
+        self.free -= 1
+        self._swap(position, self.free)
+        return True
+
+    def release(self, number: int) -> bool:
+        """Возвращает номер в свободные; False - он и так свободен или вне диапазона"""
+        value = number - self.min_number
+        if not 0 <= value < self.size:
+            return False
+        position = self._position.get(value, value)
+        if position < self.free:
+            return False
+        self._swap(position, self.free)
+        self.free += 1
+        return True
+
+class PlayerNumbers(dict):
+    """Номера игроков: user_id -> номер (int) с обратным индексом номер -> user_id
+
+    Обычный словарь для чтения; запись через [], del, pop и clear поддерживает индекс,
+    поэтому owner(номер) отвечает за O(1). Номера хранятся числами, "007" - только при выводе.
+    """
+
+    __slots__ = ('_owners',)
+
+    def __init__(self, items=()):
+        super().__init__()
+        self._owners = {}
+        for user_id, number in (items.items() if isinstance(items, dict) else items):
+            self[user_id] = number
+
+    def __setitem__(self, user_id: int, number):
+        number = int(number)
+        previous = self.get(user_id)
+        if previous is not None and self._owners.get(previous) == user_id:
+            del self._owners[previous]
+        super().__setitem__(user_id, number)
+        self._owners[number] = user_id
+
+    def __delitem__(self, user_id: int):
+        number = super().pop(user_id)
+        if self._owners.get(number) == user_id:
+            del self._owners[number]
+
+    def pop(self, user_id: int, *default):
+        if user_id in self:
+            number = self[user_id]
+            del self[user_id]
+            return number
+        if default:
+            return default[0]
+        raise KeyError(user_id)
+
+    def clear(self):
+        super().clear()
+        self._owners.clear()
+
+    def update(self, *args, **kwargs):
+        for user_id, number in dict(*args, **kwargs).items():
+            self[user_id] = number
+
+    def setdefault(self, user_id: int, number=None):
+        if user_id not in self:
+            self[user_id] = number
+        return self[user_id]
+
+    def popitem(self):
+        user_id, number = super().popitem()
+        if self._owners.get(number) == user_id:
+            del self._owners[number]
+        return user_id, number
+
+    def copy(self) -> 'PlayerNumbers':
+        return PlayerNumbers(self)
+
+    def owner(self, number: int) -> Optional[int]:
+        """ID игрока с этим номером или None"""
+        return self._owners.get(number)
+
+    def __repr__(self) -> str:
+        return f"PlayerNumbers({dict.__repr__(self)})"
+
+def format_number(number: Optional[int]) -> str:
+    """Номер игрока для вывода: 7 -> 007, нет номера -> ???"""
+    return "???" if number is None else f"{number:03d}"
+
+class RegistrationRoster:
+    """Порядок регистрации: список с O(1) проверкой/удалением и местом игрока за O(log n)
+
+    Удаленные игроки остаются пустыми слотами, а дерево Фенвика считает оставшихся,
+    поэтому место игрока и k-й игрок (страница лидерборда) находятся за O(log n).
+    Когда пустых слотов больше половины, слоты пересобираются. Сохраняется обычным списком.
+    """
+
+    __slots__ = ('_slots', '_index', '_tree', '_alive')
+    __hash__ = None
+
+    def __init__(self, user_ids=()):
+        # Повторы в старых данных схлопываются - в порядке регистрации игрок один раз
+        self._rebuild(dict.fromkeys(user_ids))
+
+    def _rebuild(self, user_ids):
+        self._slots = list(user_ids)
+        self._index = {user_id: slot for slot, user_id in enumerate(self._slots)}
+        size = len(self._slots)
+        tree = [0] * (size + 1)
+        for position in range(1, size + 1):
+            tree[position] += 1
+            parent = position + (position & -position)
+            if parent <= size:
+                tree[parent] += tree[position]
+        self._tree = tree
+        self._alive = size
+
+    def _prefix(self, position: int) -> int:
+        """Сколько игроков в слотах 1..position (нумерация дерева с 1)"""
+        total = 0
+        while position > 0:
+            total += self._tree[position]
+            position -= position & -position
+        return total
+
+    def _find(self, k: int) -> int:
+        """Слот (с 0) k-го по счету игрока (k с 1)"""
+        position = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            candidate = position + step
+            if candidate < len(self._tree) and self._tree[candidate] < k:
+                position = candidate
+                k -= self._tree[candidate]
+            step >>= 1
+        return position
+
+    def append(self, user_id: int):
+        """Добавляет игрока в конец; повторное добавление ничего не меняет"""
+        if user_id in self._index:
+            return
+        self._slots.append(user_id)
+        position = len(self._slots)
+        self._index[user_id] = position - 1
+        # Узел дерева покрывает слоты (position - lowbit, position]
+        self._tree.append(1 + self._prefix(position - 1) - self._prefix(position - (position & -position)))
+        self._alive += 1
+
+    def remove(self, user_id: int):
+        """Удаляет игрока; ValueError, если его нет (как у list)"""
+        slot = self._index.pop(user_id, None)
+        if slot is None:
+            raise ValueError(f"{user_id} нет в порядке регистрации")
+        self._slots[slot] = None
+        position = slot + 1
+        while position < len(self._tree):
+            self._tree[position] -= 1
+            position += position & -position
+        self._alive -= 1
+        if len(self._slots) > 64 and self._alive * 2 < len(self._slots):
+            self._rebuild(user_id for user_id in self._slots if user_id is not None)
+
+    def index(self, user_id: int) -> int:
+        """Место игрока (с 0); ValueError, если его нет"""
+        slot = self._index.get(user_id)
+        if slot is None:
+            raise ValueError(f"{user_id} нет в порядке регистрации")
+        return self._prefix(slot)
+
+    def clear(self):
+        self._rebuild(())
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._alive)
+            if step != 1:
+                return list(self)[key]
+            result = []
+            if start >= stop:
+                return result
+            slot = self._find(start + 1)
+            while len(result) < stop - start:
+                user_id = self._slots[slot]
+                if user_id is not None:
+                    result.append(user_id)
+                slot += 1
+            return result
+        if key < 0:
+            key += self._alive
+        if not 0 <= key < self._alive:
+            raise IndexError("индекс вне порядка регистрации")
+        return self._slots[self._find(key + 1)]
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._index
+
+    def __len__(self) -> int:
+        return self._alive
+
+    def __iter__(self):
+        return (user_id for user_id in self._slots if user_id is not None)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (RegistrationRoster, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"RegistrationRoster({list(self)})"
+
+class GuildState:
+    """Состояние сервера: владеет своими коллекциями и помнит, какие поля изменились.
+
+    Поддерживает доступ как к словарю (config['max_players']), присваивание через
+    config[...] = ... помечает поле измененным. После изменения коллекции на месте
+    нужно вызвать mark_dirty(поле).
+    """
+
+    FIELDS = tuple(DEFAULT_CONFIG)
+    SET_FIELDS = ('used_numbers', 'registered_players')
+
+    __slots__ = FIELDS + ('_dirty', '_extra', '_allocator', '_version')
+
+    def __init__(self, guild_name: str = 'Unknown Server'):
+        for field, default in DEFAULT_CONFIG.items():
+            # Каждому серверу свои коллекции, а не общие из DEFAULT_CONFIG
+            if field == 'used_numbers':
+                default = NumberPool()
+            elif field == 'registration_order':
+                default = RegistrationRoster()
+            elif field == 'player_numbers':
+                default = PlayerNumbers()
+            elif isinstance(default, (set, dict, list)):
+                default = type(default)()
+            setattr(self, field, default)
+        self.guild_name = guild_name
+        self._extra = {}
+        # Строится из used_numbers при первой выдаче номера
+        self._allocator = None
+        # Новый сервер еще нигде не сохранен целиком
+        self._dirty = set(self.FIELDS)
+        # Номера версий общие для всех состояний: замененный GuildState (/restore, /load)
+        # не повторит версию старого, и кэш рендера не отдаст его embed'ы
+        self._version = next(STATE_VERSIONS)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'GuildState':
+        """Создает состояние из сохраненных данных (JSON, бэкап, база)"""
+        state = cls(data.get('guild_name', 'Unknown Server'))
+        for field, value in data.items():
+            if field == 'used_numbers':
+                # Бинарный снапшот хранит битовую карту, JSON - список
+                value = NumberPool.from_bytes(value) if isinstance(value, bytes) else NumberPool(value)
+            elif field in cls.SET_FIELDS:
+                value = value if isinstance(value, set) else set(value)
+            elif field == 'registration_order':
+                value = RegistrationRoster(value)
+            elif field == 'player_numbers':
+                # Старые данные хранят номера строками "007"
+                value = PlayerNumbers(_int_keys(value, field))
+            elif field == 'player_titles':
+                value = {
+                    user_id: {'owned': [title_data], 'equipped': title_data} if isinstance(title_data, str) else title_data
+                    for user_id, title_data in _int_keys(value, field).items()
+                }
+
+            if field in cls.FIELDS:
+                setattr(state, field, value)
+            else:
+                state._extra[field] = value
+        state._dirty.clear()
+        return state
+
+    def to_dict(self, fields=None) -> dict:
+        """Данные для JSON. Вложенные коллекции не копируются - сериализуйте результат сразу"""
+        result = {}
+        for field in self.FIELDS if fields is None else fields:
+            if field in self.FIELDS:
+                value = getattr(self, field)
+                if field in self.SET_FIELDS:
+                    value = sorted(value)
+                elif field == 'registration_order':
+                    value = list(value)
+                result[field] = value
+            elif field in self._extra:
+                result[field] = self._extra[field]
+        if fields is None:
+            result.update(self._extra)
+        return result
+
+    def mark_dirty(self, *fields: str):
+        self._dirty.update(fields)
+        self._version = next(STATE_VERSIONS)
+
+    @property
+    def version(self) -> int:
+        """Растет при каждом изменении состояния - по нему кэш рендера понимает, что embed устарел"""
+        return self._version
+
+    def _number_allocator(self) -> NumberAllocator:
+        if self._allocator is None:
+            self._allocator = NumberAllocator(self.min_number, self.max_number, self.used_numbers)
+        return self._allocator
+
+    def allocate_number(self) -> Optional[int]:
+        """Выдает случайный свободный номер за O(1); None - все номера заняты"""
+        number = self._number_allocator().allocate()
+        if number is not None:
+            self.used_numbers.add(number)
+            self.mark_dirty('used_numbers')
+        return number
+
+    def reserve_number(self, number: int) -> bool:
+        """Занимает конкретный номер; False - он уже занят"""
+        if number in self.used_numbers:
+            return False
+        self._number_allocator().reserve(number)
+        self.used_numbers.add(number)
+        self.mark_dirty('used_numbers')
+        return True
+
+    def release_number(self, number: int):
+        """Освобождает номер (/reset, /changenumber)"""
+        if number in self.used_numbers:
+            self.used_numbers.discard(number)
+            self._number_allocator().release(number)
+            self.mark_dirty('used_numbers')
+
+    def clear_numbers(self):
+        """Освобождает все номера (/end)"""
+        self.used_numbers.clear()
+        self._allocator = None
+        self.mark_dirty('used_numbers')
+
+    def take_dirty(self) -> set:
+        """Возвращает измененные поля и сбрасывает отметки"""
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def __getitem__(self, field: str):
+        if field in self.FIELDS:
+            return getattr(self, field)
+        return self._extra[field]
+
+    def __setitem__(self, field: str, value):
+        if field in ('used_numbers', 'min_number', 'max_number'):
+            self._allocator = None
+        if field in self.FIELDS:
+            setattr(self, field, value)
+        else:
+            self._extra[field] = value
+        self.mark_dirty(field)
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.FIELDS or field in self._extra
+
+    def get(self, field: str, default=None):
+        if field in self.FIELDS:
+            return getattr(self, field)
+        return self._extra.get(field, default)
+
+    def keys(self):
+        return list(self.FIELDS) + list(self._extra)
+
+    def items(self):
+        return [(field, self[field]) for field in self.keys()]
+
+def get_guild_config(guild_id: int, guild_name: str = "Unknown Server") -> GuildState:
     """Получает конфигурацию для сервера, создает новую если не существует"""
-    if guild_id not in GUILD_DATA:
-        # Создаем новую конфигурацию для сервера
-        new_config = DEFAULT_CONFIG.copy()
-        new_config['guild_name'] = guild_name
-        
-        # Убеждаемся, что множества действительно являются множествами
-        if isinstance(new_config['used_numbers'], list):
-            new_config['used_numbers'] = set(new_config['used_numbers'])
-        if isinstance(new_config['registered_players'], list):
-            new_config['registered_players'] = set(new_config['registered_players'])
-        
-        GUILD_DATA[guild_id] = new_config
+    config = GUILD_DATA.get(guild_id)
+    if config is not None:
+        return config
+
+    # Хранилище может подгружать серверы по требованию (SQLite)
+    stored_config = STORAGE.load_guild(guild_id)
+    if stored_config is not None:
+        config = GuildState.from_dict(stored_config)
+    else:
+        config = GuildState(guild_name)
         logger.info(f"🆕 Создана новая конфигурация для сервера {guild_name} ({guild_id})")
+
+    GUILD_DATA[guild_id] = config
+    return config
+
+# Команды, меняющие состояние, выполняются внутри сервера по очереди; разные серверы друг друга не ждут
+GUILD_LOCKS = {}
+
+def guild_lock(guild_id: int) -> asyncio.Lock:
+    """Блокировка состояния сервера (reg, reset, changenumber, end, buy, restore)"""
+    lock = GUILD_LOCKS.get(guild_id)
+    if lock is None:
+        lock = GUILD_LOCKS[guild_id] = asyncio.Lock()
+    return lock
+
+async def acquire_or_defer(lock: asyncio.Lock, defer, wait: float) -> bool:
+    """Берет блокировку; если она занята или за wait секунд не освободилась - вызывает defer()
+
+    Одной проверки lock.locked() мало: сразу после освобождения блокировка свободна, но ее
+    уже ждет следующая команда, и новый запрос встанет за ней. Возвращает True, если пришлось
+    отложить ответ. Освобождает блокировку вызывающий.
+    """
+    if not lock.locked():
+        try:
+            await asyncio.wait_for(lock.acquire(), wait)
+            return False
+        except asyncio.TimeoutError:
+            pass
+    await defer()
+    await lock.acquire()
+    return True
+
+# Покупки одного игрока идут по очереди: между проверкой баланса и списанием есть запросы к API
+PURCHASE_LOCKS = {}
+
+def purchase_lock(guild_id: int, user_id: int) -> asyncio.Lock:
+    """Блокировка покупок игрока на сервере (buy)"""
+    key = (guild_id, user_id)
+    lock = PURCHASE_LOCKS.get(key)
+    if lock is None:
+        lock = PURCHASE_LOCKS[key] = asyncio.Lock()
+    return lock
+
+def admit_player(config: GuildState, user_id: int) -> tuple:
+    """Проверяет и регистрирует игрока одним шагом, без await между проверкой и записью
+
+    Возвращает (статус, номер): 'ok', 'closed', 'full', 'registered' или 'no_numbers'.
+    """
+    if not config['registration_open']:
+        return 'closed', None
+    if len(config['registered_players']) >= config['max_players']:
+        return 'full', None
+    if user_id in config['registered_players']:
+        return 'registered', None
+
+    player_number = config.allocate_number()
+    if player_number is None:
+        return 'no_numbers', None
+
+    config['registered_players'].add(user_id)
+    config['player_numbers'][user_id] = player_number
+    if user_id not in config['registration_order']:
+        config['registration_order'].append(user_id)
+    config.mark_dirty('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
+    return 'ok', player_number
+
+IMPORT_MENTION_RE = re.compile(r'^<@!?(\d+)>$')
+
+def parse_import_roster(text: str) -> tuple:
+    """Разбирает файл импорта: в строке ID участника (или упоминание) и, по желанию, номер
+
+    Разделители - пробелы, запятые или точки с запятой; пустые строки и строки с # пропускаются.
+    Возвращает (записи [(user_id, номер или None)], ошибки ["строка N: ..."]).
+    """
+    entries = []
+    errors = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [part for part in re.split(r'[\s,;]+', line) if part]
+        mention = IMPORT_MENTION_RE.match(parts[0])
+        user_token = mention.group(1) if mention else parts[0]
+        if not user_token.isdigit():
+            # Заголовок CSV (например "user_id,number") - не ошибка
+            if line_no == 1:
+                continue
+            errors.append(f"строка {line_no}: не ID участника `{parts[0][:32]}`")
+            continue
+        number = None
+        if len(parts) > 1:
+            if not parts[1].isdigit():
+                errors.append(f"строка {line_no}: номер `{parts[1][:16]}` не число")
+                continue
+            number = int(parts[1])
+        entries.append((int(user_token), number))
+    return entries, errors
+
+def import_players(config: GuildState, entries: list) -> tuple:
+    """Регистрирует список участников за один проход, по тем же правилам, что и /reg
+
+    Запрошенные номера занимаются первыми, остальные выдаются случайно из свободных;
+    registration_order пополняется в порядке файла. Вызывать под guild_lock.
+    Возвращает (принятые [(user_id, номер)], пропущенные [(user_id, причина)]).
+    """
+    capacity = config['max_players'] - len(config['registered_players'])
+    accepted = []
+    skipped = []
+    seen = set()
+    for user_id, number in entries:
+        if user_id in seen:
+            skipped.append((user_id, "повтор в файле"))
+            continue
+        seen.add(user_id)
+        if user_id in config['registered_players']:
+            skipped.append((user_id, "уже зарегистрирован"))
+        elif len(accepted) >= capacity:
+            skipped.append((user_id, f"нет мест (максимум {config['max_players']})"))
+        elif number is not None and not config['min_number'] <= number <= config['max_number']:
+            skipped.append((user_id, f"номер {number} вне диапазона {config['min_number']}-{config['max_number']}"))
+        elif number is not None and not config.reserve_number(number):
+            skipped.append((user_id, f"номер {number} уже занят"))
+        else:
+            accepted.append([user_id, number])
     
-    # Всегда проверяем типы данных при возврате конфигурации
-    config = GUILD_DATA[guild_id]
-    if isinstance(config.get('used_numbers'), list):
-        config['used_numbers'] = set(config['used_numbers'])
-    if isinstance(config.get('registered_players'), list):
-        config['registered_players'] = set(config['registered_players'])
+    imported = []
+    for entry in accepted:
+        if entry[1] is None:
+            entry[1] = config.allocate_number()
+            if entry[1] is None:
+                skipped.append((entry[0], "закончились свободные номера"))
+                continue
+        user_id, number = entry
+        config['registered_players'].add(user_id)
+        config['player_numbers'][user_id] = number
+        config['registration_order'].append(user_id)
+        imported.append((user_id, number))
     
+    if imported:
+        config.mark_dirty('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
+    return imported, skipped
+
+class GuildObjectCache:
+    """Кэш объектов Discord, которые команды ищут постоянно: роль регистрации и каналы
+
+    Роль ищется по сохраненному registration_role_id (по имени - только если ID еще нет),
+    каналы - по ID из конфига без перебора серверов в bot.get_channel, сообщение лидерборда -
+    частичным сообщением из сохраненных ID, без fetch_message.
+    Сбрасывается событиями изменения/удаления ролей и каналов.
+    """
+
+    def __init__(self):
+        self._roles = {}
+        self._channels = {}
+        # guild_id -> ((channel_id, message_id), PartialMessage)
+        self._leaderboards = {}
+
+    def registration_role(self, guild, config: GuildState):
+        """Роль зарегистрированных игроков сервера или None"""
+        role = self._roles.get(guild.id)
+        if role is not None:
+            return role
+        
+        role_id = config['registration_role_id']
+        role = guild.get_role(role_id) if role_id else None
+        if role is None:
+            role = discord.utils.get(guild.roles, name=config['registration_role_name'])
+        if role is not None:
+            self.remember_role(guild.id, config, role)
+        return role
+
+    def remember_role(self, guild_id: int, config: GuildState, role):
+        """Запоминает роль (в том числе только что созданную) и сохраняет ее ID в конфиге"""
+        self._roles[guild_id] = role
+        if config['registration_role_id'] != role.id:
+            config['registration_role_id'] = role.id
+            request_save(guild_id)
+
+    def forget_role(self, role):
+        """Сбрасывает роль из кэша (роль изменена или удалена)"""
+        cached = self._roles.get(role.guild.id)
+        if cached is not None and cached.id == role.id:
+            del self._roles[role.guild.id]
+
+    def channel(self, channel_id):
+        """Канал по ID (лидерборд, бэкапы) или None"""
+        if not channel_id:
+            return None
+        channel = self._channels.get(int(channel_id))
+        if channel is None:
+            channel = bot.get_channel(int(channel_id))
+            if channel is not None:
+                self._channels[int(channel_id)] = channel
+        return channel
+
+    def forget_channel(self, channel_id: int):
+        self._channels.pop(channel_id, None)
+        for guild_id, (ids, _) in list(self._leaderboards.items()):
+            if ids[0] == channel_id:
+                del self._leaderboards[guild_id]
+
+    def leaderboard_message(self, guild_id: int, config: GuildState):
+        """Частичное сообщение лидерборда для правки без лишнего GET или None"""
+        ids = (config['leaderboard_channel_id'], config['leaderboard_message_id'])
+        cached = self._leaderboards.get(guild_id)
+        if cached is not None and cached[0] == ids:
+            return cached[1]
+        channel = self.channel(ids[0])
+        if channel is None or not ids[1]:
+            return None
+        message = channel.get_partial_message(int(ids[1]))
+        self._leaderboards[guild_id] = (ids, message)
+        return message
+
+    def forget_leaderboard(self, guild_id: int):
+        self._leaderboards.pop(guild_id, None)
+
+GUILD_OBJECTS = GuildObjectCache()
+
+class PlayerSearchIndex:
+    """Префиксный индекс игроков одного сервера: отсортированный список (ключ, user_id)
+
+    Ключи - ник целиком, отдельные слова ника и номер ("042" и "42"), в нижнем регистре.
+    Поиск - bisect к первому ключу с префиксом и проход по подряд идущим совпадениям.
+    """
+
+    WORD_RE = re.compile(r'\w+')
+
+    def __init__(self):
+        self._entries = []
+        self._keys = {}
+
+    @classmethod
+    def _search_keys(cls, name: str, number: Optional[int]) -> set:
+        name = name.casefold().strip()
+        keys = set(cls.WORD_RE.findall(name))
+        if name:
+            keys.add(name)
+        if number is not None:
+            keys.add(format_number(number))
+            keys.add(str(number))
+        return keys
+
+    @classmethod
+    def build(cls, players) -> 'PlayerSearchIndex':
+        """Индекс из (user_id, ник, номер) одной сортировкой, без вставок по одному"""
+        index = cls()
+        for user_id, name, number in players:
+            keys = cls._search_keys(name, number)
+            index._keys[user_id] = keys
+            index._entries.extend((key, user_id) for key in keys)
+        index._entries.sort()
+        return index
+
+    def add(self, user_id: int, name: str, number: Optional[int]):
+        """Добавляет игрока или обновляет его ник/номер"""
+        self.remove(user_id)
+        keys = self._search_keys(name, number)
+        for key in keys:
+            bisect.insort(self._entries, (key, user_id))
+        self._keys[user_id] = keys
+
+    def remove(self, user_id: int):
+        for key in self._keys.pop(user_id, ()):
+            index = bisect.bisect_left(self._entries, (key, user_id))
+            if index < len(self._entries) and self._entries[index] == (key, user_id):
+                del self._entries[index]
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """ID игроков, у которых ник, слово ника или номер начинается с query"""
+        query = query.casefold().strip()
+        found = []
+        seen = set()
+        index = bisect.bisect_left(self._entries, (query,))
+        while index < len(self._entries) and len(found) < limit:
+            key, user_id = self._entries[index]
+            if not key.startswith(query):
+                break
+            if user_id not in seen:
+                seen.add(user_id)
+                found.append(user_id)
+            index += 1
+        return found
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+class PlayerSearch:
+    """Индексы поиска игроков по серверам для /find
+
+    Индекс строится при первом поиске и дальше обновляется точечно: регистрация, сброс,
+    смена номера и ника. Если состояние сервера заменено целиком (/restore, /load),
+    индекс перестраивается сам - он помнит, из какого GuildState построен.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+
+    @staticmethod
+    def player_name(guild, user_id: int) -> str:
+        """Текущее отображаемое имя игрока (из кэша участников, без запросов к API)"""
+        user = guild.get_member(user_id) or bot.get_user(user_id)
+        return user.display_name if user else str(user_id)
+
+    def _index(self, guild_id: int) -> Optional[PlayerSearchIndex]:
+        """Уже построенный и актуальный индекс сервера или None"""
+        entry = self._indexes.get(guild_id)
+        if entry is None or GUILD_DATA.get(guild_id) is not entry[0]:
+            return None
+        return entry[1]
+
+    def index(self, guild) -> PlayerSearchIndex:
+        index = self._index(guild.id)
+        if index is None:
+            config = get_guild_config(guild.id, guild.name)
+            index = PlayerSearchIndex.build(
+                (user_id, self.player_name(guild, user_id), config['player_numbers'].get(user_id))
+                for user_id in config['registered_players']
+            )
+            self._indexes[guild.id] = (config, index)
+        return index
+
+    def search(self, guild, query: str, limit: int = 25) -> list:
+        return self.index(guild).search(query, limit)
+
+    def add(self, guild, user_id: int, number: Optional[int]):
+        """Игрок зарегистрирован или сменил номер"""
+        index = self._index(guild.id)
+        if index is not None:
+            index.add(user_id, self.player_name(guild, user_id), number)
+
+    def remove(self, guild_id: int, user_id: int):
+        index = self._index(guild_id)
+        if index is not None:
+            index.remove(user_id)
+
+    def rename(self, member):
+        """Участник сменил ник - обновляем ключи, если он в индексе"""
+        index = self._index(member.guild.id)
+        if index is not None and member.id in index:
+            config = GUILD_DATA[member.guild.id]
+            index.add(member.id, member.display_name, config['player_numbers'].get(member.id))
+
+    def invalidate(self, guild_id: int):
+        """Массовое изменение (/end, импорт) - индекс перестроится при следующем поиске"""
+        self._indexes.pop(guild_id, None)
+
+PLAYER_SEARCH = PlayerSearch()
+
+class RenderCache:
+    """Готовые embed'ы команд только для чтения (/leaderboard, /status, /players_list, /server_info)
+
+    Ключ - (вид, страница, язык, версия состояния сервера): пока состояние не менялось,
+    команда получает уже построенный embed за O(1). Для сервера хранится только текущая
+    версия; серверы, к которым давно не обращались, и лишние сверх лимита вытесняются.
+    """
+
+    MAX_VIEWS_PER_GUILD = 64
+
+    def __init__(self, max_guilds: int, ttl: float):
+        self.max_guilds = max_guilds
+        self.ttl = ttl
+        # guild_id -> [время последнего обращения, версия, {ключ: embed}], от давних к свежим
+        self._guilds = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def render(self, guild_id: int, view: str, page: int, config: GuildState, build, cacheable=None):
+        """Embed из кэша или build() (обычная функция или корутина), который затем кэшируется
+
+        cacheable() вызывается после build(); False - embed неполный (например, пользователя
+        еще нет в кэше Discord) и в кэш не попадает.
+        """
+        key = (view, page, config.get('language', 'ru'), config.version)
+        now = time.monotonic()
+        entry = self._guilds.get(guild_id)
+        if entry is not None:
+            self._guilds.move_to_end(guild_id)
+            entry[0] = now
+            embed = entry[2].get(key)
+            if embed is not None:
+                self.hits += 1
+                return embed
+        
+        self.misses += 1
+        embed = build()
+        if asyncio.iscoroutine(embed):
+            embed = await embed
+        
+        # Пока строили, состояние могло измениться - такой embed не кэшируем
+        if key[3] != config.version or GUILD_DATA.get(guild_id) is not config:
+            return embed
+        if cacheable is not None and not cacheable():
+            return embed
+        entry = self._guilds.get(guild_id)
+        if entry is None:
+            entry = self._guilds[guild_id] = [now, key[3], {}]
+            self._evict(now)
+        if entry[1] != key[3]:
+            entry[1] = key[3]
+            entry[2].clear()
+        views = entry[2]
+        if len(views) >= self.MAX_VIEWS_PER_GUILD:
+            del views[next(iter(views))]
+        views[key] = embed
+        return embed
+
+    def invalidate(self, guild_id: int):
+        """Сбрасывает embed'ы сервера (изменилось то, чего нет в состоянии, например ник)"""
+        self._guilds.pop(guild_id, None)
+
+    def _evict(self, now: float):
+        while len(self._guilds) > self.max_guilds:
+            self._guilds.popitem(last=False)
+        while self._guilds:
+            guild_id, entry = next(iter(self._guilds.items()))
+            if now - entry[0] < self.ttl:
+                break
+            del self._guilds[guild_id]
+
+    def __len__(self) -> int:
+        return len(self._guilds)
+
+RENDERS = RenderCache(RENDER_CACHE_GUILDS, RENDER_CACHE_TTL)
+
+# ==================== ХРАНИЛИЩЕ ДАННЫХ ====================
+
+def write_file_atomic(path: str, content):
+    """Пишет файл (str или bytes) через временный файл и os.replace, чтобы не оставить его недописанным"""
+    temp_filename = path + '.tmp'
+    try:
+        if isinstance(content, bytes):
+            with open(temp_filename, 'wb') as f:
+                f.write(content)
+        else:
+            with open(temp_filename, 'w', encoding='utf-8') as f:
+                f.write(content)
+        os.replace(temp_filename, path)
+    except Exception:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+def encode_binary_snapshot(data: dict) -> bytes:
+    """Упаковывает снапшот в бинарный формат: заголовок с версией и CRC32 + marshal"""
+    payload = marshal.dumps(data, marshal.version)
+    header = BINARY_SNAPSHOT_HEADER.pack(
+        BINARY_SNAPSHOT_MAGIC, BINARY_SNAPSHOT_VERSION, marshal.version, len(payload), zlib.crc32(payload)
+    )
+    return header + payload
+
+def decode_binary_snapshot(blob: bytes) -> dict:
+    """Распаковывает бинарный снапшот, ValueError если файл поврежден или несовместим"""
+    if len(blob) < BINARY_SNAPSHOT_HEADER.size:
+        raise ValueError("файл короче заголовка")
+    magic, version, marshal_version, length, checksum = BINARY_SNAPSHOT_HEADER.unpack_from(blob)
+    if magic != BINARY_SNAPSHOT_MAGIC:
+        raise ValueError("неверная сигнатура")
+    if version != BINARY_SNAPSHOT_VERSION or marshal_version != marshal.version:
+        raise ValueError(f"несовместимая версия формата ({version}/{marshal_version})")
+    payload = blob[BINARY_SNAPSHOT_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise ValueError("не совпадает длина или контрольная сумма")
+    return marshal.loads(payload)
+
+class JsonStorage:
+    """Хранит все серверы в одном файле, который перезаписывается целиком.
+
+    Снапшот пишется в JSON или, при SNAPSHOT_FORMAT=binary, в бинарный файл рядом,
+    который быстрее читается при запуске. Предыдущий бинарный снапшот сохраняется
+    как .bin.bak: JSON в этом режиме не обновляется, и откатываться на него нельзя.
+    """
+
+    def __init__(self, path: str = DATA_FILE, snapshot_format: str = SNAPSHOT_FORMAT):
+        self.path = path
+        self.binary_path = os.path.splitext(path)[0] + '.bin'
+        self.binary_backup_path = self.binary_path + '.bak'
+        self.snapshot_format = snapshot_format
+        # Данные на диске не прочитаны - запись отключена, чтобы не затереть их пустым состоянием
+        self.corrupted = False
+
+    def snapshot(self, guild_ids=None):
+        """Готовит данные к записи; guild_ids - изменившиеся серверы (None - все)"""
+        return self.encode_snapshot(self.snapshot_data())
+
+    def snapshot_data(self) -> dict:
+        """Снапшот всех серверов в виде словаря (еще не закодированный)"""
+        binary = self.snapshot_format == 'binary'
+        data = {
+            'guilds': {},
+            'saved_at': str(datetime.datetime.now()),
+            'version': '2.0'
+        }
+        for guild_id, config in GUILD_DATA.items():
+            config.take_dirty()
+            if binary:
+                # marshal хранит множества и int ключи как есть - без конвертации при загрузке;
+                # занятые номера пишутся битовой картой
+                data['guilds'][guild_id] = {
+                    field: value.to_bytes() if isinstance(value, NumberPool)
+                    else list(value) if isinstance(value, RegistrationRoster)
+                    else dict(value) if isinstance(value, PlayerNumbers) else value
+                    for field, value in config.items()
+                }
+            else:
+                data['guilds'][str(guild_id)] = config.to_dict()
+        return data
+
+    def encode_snapshot(self, data: dict):
+        if self.snapshot_format == 'binary':
+            return encode_binary_snapshot(data)
+        return json.dumps(data, indent=2, ensure_ascii=False)
+
+    def ensure_writable(self):
+        if self.corrupted:
+            raise RuntimeError("снапшот на диске поврежден - запись отключена до ручного восстановления")
+
+    def write(self, payload):
+        """Атомарно записывает подготовленный снапшот"""
+        self.ensure_writable()
+        if isinstance(payload, bytes):
+            # Прошлый снапшот остается резервной копией на случай, если новый окажется поврежден
+            if os.path.exists(self.binary_path):
+                os.replace(self.binary_path, self.binary_backup_path)
+            write_file_atomic(self.binary_path, payload)
+        else:
+            write_file_atomic(self.path, payload)
+
+    def write_failed(self):
+        """Вызывается, если запись не удалась"""
+
+    def save(self, guild_ids=None):
+        try:
+            self.write(self.snapshot(guild_ids))
+        except Exception:
+            self.write_failed()
+            raise
+
+    def load_guild(self, guild_id: int) -> Optional[dict]:
+        """Подгружает один сервер по требованию (для хранилищ с ленивой загрузкой)"""
+        return None
+
+    def load(self) -> Optional[dict]:
+        """Читает данные с диска, None если файла нет"""
+        self.corrupted = False
+        json_exists = os.path.exists(self.path)
+        binary_paths = [path for path in (self.binary_path, self.binary_backup_path) if os.path.exists(path)]
+        # Бинарный снапшот берем, только если он не старше JSON (например, после смены формата)
+        if binary_paths and (
+            not json_exists or max(os.path.getmtime(path) for path in binary_paths) >= os.path.getmtime(self.path)
+        ):
+            for path in binary_paths:
+                try:
+                    with open(path, 'rb') as f:
+                        data = decode_binary_snapshot(f.read())
+                except (OSError, ValueError, EOFError, TypeError) as e:
+                    logger.error(f"❌ Бинарный снапшот {path} не прочитан: {e}")
+                    continue
+                if path == self.binary_backup_path:
+                    logger.warning(f"⚠️ Загружена резервная копия {path} - последние изменения могли потеряться")
+                return data
+            
+            # JSON при бинарном формате не обновляется - загрузка с него молча откатила бы данные
+            self.corrupted = True
+            logger.critical(
+                f"🛑 Не прочитан ни {self.binary_path}, ни резервная копия. Запись данных отключена, "
+                f"чтобы не затереть файлы; восстановите снапшот вручную и перезапустите бота"
+            )
+            raise ValueError("бинарный снапшот и его резервная копия повреждены")
+
+        if not json_exists:
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+class JournalStorage(JsonStorage):
+    """Снапшот + журнал: каждое изменение дописывается в журнал одной компактной строкой
+
+    Снапшот и записи журнала помечены поколением. Каждое сжатие начинает новое поколение,
+    и при загрузке записи старше снапшота пропускаются: если бот упал после замены снапшота,
+    но до очистки журнала, старые записи не откатят более новые данные.
+    """
+
+    def __init__(self, path: str = DATA_FILE, journal_path: str = JOURNAL_FILE, compact_every: int = JOURNAL_COMPACT_EVERY):
+        super().__init__(path)
+        self.journal_path = journal_path
+        self.compact_every = max(1, compact_every)
+        self.records_since_snapshot = 0
+        self.needs_compaction = False
+        self.generation = 0
+
+    def snapshot(self, guild_ids=None):
+        if self.needs_compaction or self.records_since_snapshot >= self.compact_every:
+            # Поколение растет при подготовке: записи, подготовленные после этого снапшота,
+            # уже относятся к новому поколению, даже если снапшот еще не записан
+            self.generation += 1
+            data = self.snapshot_data()
+            data['journal_generation'] = self.generation
+            return ('snapshot', self.encode_snapshot(data))
+
+        if guild_ids is None:
+            guild_ids = list(GUILD_DATA)
+
+        records = []
+        for guild_id in guild_ids:
+            config = GUILD_DATA.get(guild_id)
+            if config is None:
+                continue
+            dirty = config.take_dirty()
+            if dirty:
+                record = {'n': self.generation, 'g': str(guild_id), 'f': config.to_dict(dirty)}
+                records.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        return ('journal', records)
+
+    def write(self, payload):
+        kind, data = payload
+        if kind == 'snapshot':
+            super().write(data)
+            # Снапшот уже содержит всё - журнал можно обнулить
+            with open(self.journal_path, 'w', encoding='utf-8'):
+                pass
+            self.records_since_snapshot = 0
+            self.needs_compaction = False
+            logger.info("🗜️ Журнал данных сжат в новый снапшот")
+        elif data:
+            self.ensure_writable()
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(data))
+            self.records_since_snapshot += len(data)
+
+    def write_failed(self):
+        # Отметки об изменениях уже сняты - следующая запись будет полным снапшотом
+        self.needs_compaction = True
+
+    def load(self) -> Optional[dict]:
+        self.records_since_snapshot = 0
+        data = super().load()
+        # Записи без поколения (старый журнал) относятся к поколению 0
+        snapshot_generation = data.get('journal_generation', 0) if isinstance(data, dict) else 0
+        self.generation = snapshot_generation
+
+        if data is not None and 'guilds' not in data:
+            # Старый формат - при первом сохранении перепишем его полным снапшотом
+            self.needs_compaction = True
+            return data
+
+        if not os.path.exists(self.journal_path):
+            return data
+
+        if data is None:
+            data = {'guilds': {}, 'version': '2.0'}
+        # В бинарном снапшоте ключи - int, в журнале - строки
+        data['guilds'] = {str(guild_id): config for guild_id, config in data['guilds'].items()}
+
+        stale = 0
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    generation = record.get('n', 0)
+                    if generation < snapshot_generation:
+                        # Запись уже вошла в снапшот (сжатие прервалось до очистки журнала)
+                        stale += 1
+                        continue
+                    data['guilds'].setdefault(record['g'], {}).update(record['f'])
+                    self.generation = max(self.generation, generation)
+                    self.records_since_snapshot += 1
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # Обычно это недописанная строка после аварийного завершения
+                    logger.warning(f"⚠️ Пропущена поврежденная запись журнала (строка {line_number})")
+                    self.needs_compaction = True
+
+        if stale:
+            logger.warning(f"⚠️ Пропущено записей журнала старше снапшота: {stale} - журнал будет сжат")
+            self.needs_compaction = True
+        logger.info(f"📜 Из журнала применено записей: {self.records_since_snapshot}")
+        return data
+
+class ShardedStorage(JsonStorage):
+    """Отдельный файл на каждый сервер + небольшой индекс со списком серверов"""
+
+    def __init__(self, directory: str = SHARD_DIR, legacy_path: str = DATA_FILE):
+        super().__init__(legacy_path)
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+        self.needs_full_write = False
+        self._indexed = set()
+
+    def shard_path(self, guild_id) -> str:
+        return os.path.join(self.directory, f"guild_{guild_id}.json")
+
+    def snapshot(self, guild_ids=None):
+        if guild_ids is None or self.needs_full_write:
+            guild_ids = list(GUILD_DATA)
+
+        files = []
+        for guild_id in guild_ids:
+            config = GUILD_DATA.get(guild_id)
+            if config is None:
+                continue
+            config.take_dirty()
+            shard = {
+                'guild_id': str(guild_id),
+                'saved_at': str(datetime.datetime.now()),
+                'version': '2.0',
+                'config': config.to_dict()
+            }
+            files.append((self.shard_path(guild_id), json.dumps(shard, indent=2, ensure_ascii=False)))
+
+        # Индекс переписываем только когда меняется набор серверов
+        guild_set = {str(guild_id) for guild_id in GUILD_DATA}
+        index = None
+        if guild_set != self._indexed:
+            index = json.dumps({
+                'guilds': sorted(guild_set),
+                'saved_at': str(datetime.datetime.now()),
+                'version': '2.0'
+            }, indent=2)
+        return files, index, guild_set
+
+    def write(self, payload):
+        files, index, guild_set = payload
+        os.makedirs(self.directory, exist_ok=True)
+        # Сначала шарды, затем индекс - индекс никогда не ссылается на незаписанный шард
+        for path, text in files:
+            write_file_atomic(path, text)
+        if index is not None:
+            write_file_atomic(self.index_path, index)
+            self._indexed = guild_set
+        self.needs_full_write = False
+
+    def write_failed(self):
+        # Какие-то шарды могли не записаться - при следующем сохранении пишем все
+        self.needs_full_write = True
+
+    def _read_shard(self, guild_id_str: str):
+        path = self.shard_path(guild_id_str)
+        if not os.path.exists(path):
+            logger.warning(f"⚠️ Шард сервера {guild_id_str} указан в индексе, но файл не найден")
+            return guild_id_str, None
+        with open(path, 'r', encoding='utf-8') as f:
+            return guild_id_str, json.load(f).get('config')
+
+    def load(self) -> Optional[dict]:
+        self._indexed = set()
+
+        if not os.path.exists(self.index_path):
+            # Переходим с общего файла: читаем его и при первом сохранении раскладываем по шардам
+            data = super().load()
+            if data is not None:
+                logger.info("🔄 Индекс шардов не найден, данные будут разложены по файлам серверов")
+                self.needs_full_write = True
+            return data
+
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+
+        guild_ids = [str(guild_id) for guild_id in index.get('guilds', [])]
+        data = {'guilds': {}, 'version': index.get('version', '2.0')}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(guild_ids) or 1)) as executor:
+            for guild_id_str, config in executor.map(self._read_shard, guild_ids):
+                if config is not None:
+                    data['guilds'][guild_id_str] = config
+
+        self._indexed = set(guild_ids)
+        logger.info(f"🧩 Прочитано шардов серверов: {len(data['guilds'])}/{len(guild_ids)}")
+        return data
+
+class SqliteStorage(JsonStorage):
+    """SQLite в режиме WAL: настройки, регистрации и титулы в отдельных таблицах.
+
+    Пишутся только изменившиеся строки, серверы подгружаются при первом обращении.
+    """
+
+    # Поля, которые хранятся в отдельных таблицах, а не в guild_settings
+    COLLECTION_FIELDS = ('used_numbers', 'registered_players', 'player_numbers', 'registration_order', 'player_titles')
+    REGISTRATION_FIELDS = ('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS guilds (
+            guild_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS guild_settings (
+            guild_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (guild_id, key)
+        );
+        CREATE TABLE IF NOT EXISTS registrations (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            number INTEGER,
+            reg_order INTEGER,
+            registered INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_registrations_number ON registrations (guild_id, number);
+        CREATE TABLE IF NOT EXISTS titles (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            owned INTEGER NOT NULL DEFAULT 1,
+            equipped INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id, title)
+        );
+    """
+
+    def __init__(self, path: str = SQLITE_FILE):
+        super().__init__(path)
+        self._reader = None
+        self._writer = None
+        # guild_id -> строки, которые уже лежат в базе
+        self._persisted = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(self.SCHEMA)
+        return connection
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        # Чтение идет из потока событий, запись - из фонового потока; WAL позволяет им не мешать друг другу
+        if self._reader is None:
+            self._reader = self._connect()
+        return self._reader
+
+    @property
+    def writer(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    def _settings_rows(self, config: GuildState) -> dict:
+        return {
+            key: json.dumps(value, ensure_ascii=False)
+            for key, value in config.items()
+            if key not in self.COLLECTION_FIELDS
+        }
+
+    def _registration_rows(self, config: GuildState, previous: dict) -> dict:
+        registered = config['registered_players']
+        numbers = config['player_numbers']
+
+        # Порядок храним возрастающими номерами: добавление и удаление игрока не сдвигают остальных
+        previous_orders = {user_id: row[1] for user_id, row in previous.items() if row[1] is not None}
+        orders = {}
+        next_order = max(previous_orders.values(), default=0) + 1
+        last_order = 0
+        for user_id in config['registration_order']:
+            if user_id in orders:
+                continue
+            order = previous_orders.get(user_id)
+            if order is None or order <= last_order:
+                order = next_order
+                next_order += 1
+            orders[user_id] = order
+            last_order = order
+
+        rows = {}
+        for user_id in registered | numbers.keys() | orders.keys():
+            rows[user_id] = (numbers.get(user_id), orders.get(user_id), 1 if user_id in registered else 0)
+        return rows
+
+    def _title_rows(self, config: GuildState) -> dict:
+        rows = {}
+        for user_id, title_data in config['player_titles'].items():
+            owned, equipped = title_data.get('owned', []), title_data.get('equipped')
+            for title in owned:
+                rows[(user_id, title)] = (1, 1 if title == equipped else 0)
+            if equipped and equipped not in owned:
+                rows[(user_id, equipped)] = (0, 1)
+        return rows
+
+    @staticmethod
+    def _diff(previous: dict, current: dict, upsert, delete) -> list:
+        ops = [upsert(key, row) for key, row in current.items() if previous.get(key) != row]
+        ops.extend(delete(key) for key in previous.keys() - current.keys())
+        return ops
+
+    def guild_ops(self, guild_id: int, config: GuildState) -> list:
+        """SQL операции, приводящие строки сервера в базе к текущему состоянию"""
+        dirty = config.take_dirty()
+        previous = self._persisted.get(guild_id)
+
+        ops = []
+        if previous is None:
+            # Базы для сравнения нет - переписываем сервер целиком
+            dirty = set(config.keys())
+            previous = {'settings': {}, 'registrations': {}, 'titles': {}}
+            ops.append(("INSERT OR IGNORE INTO guilds (guild_id) VALUES (?)", (guild_id,)))
+            for table in ('guild_settings', 'registrations', 'titles'):
+                ops.append((f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,)))
+
+        # Пересчитываем только те таблицы, поля которых изменились
+        current = dict(previous)
+        if dirty - set(self.COLLECTION_FIELDS):
+            current['settings'] = self._settings_rows(config)
+            ops.extend(self._diff(
+                previous['settings'], current['settings'],
+                lambda key, value: (
+                    "INSERT INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (guild_id, key) DO UPDATE SET value = excluded.value",
+                    (guild_id, key, value)
+                ),
+                lambda key: ("DELETE FROM guild_settings WHERE guild_id = ? AND key = ?", (guild_id, key))
+            ))
+
+        if dirty & set(self.REGISTRATION_FIELDS):
+            current['registrations'] = self._registration_rows(config, previous['registrations'])
+            ops.extend(self._diff(
+                previous['registrations'], current['registrations'],
+                lambda user_id, row: (
+                    "INSERT INTO registrations (guild_id, user_id, number, reg_order, registered) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (guild_id, user_id) DO UPDATE SET number = excluded.number, "
+                    "reg_order = excluded.reg_order, registered = excluded.registered",
+                    (guild_id, user_id, *row)
+                ),
+                lambda user_id: ("DELETE FROM registrations WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+            ))
+
+        if 'player_titles' in dirty:
+            current['titles'] = self._title_rows(config)
+            ops.extend(self._diff(
+                previous['titles'], current['titles'],
+                lambda key, row: (
+                    "INSERT INTO titles (guild_id, user_id, title, owned, equipped) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (guild_id, user_id, title) DO UPDATE SET owned = excluded.owned, equipped = excluded.equipped",
+                    (guild_id, *key, *row)
+                ),
+                lambda key: ("DELETE FROM titles WHERE guild_id = ? AND user_id = ? AND title = ?", (guild_id, *key))
+            ))
+
+        self._persisted[guild_id] = current
+        return ops
+
+    def snapshot(self, guild_ids=None):
+        if guild_ids is None:
+            guild_ids = list(GUILD_DATA)
+        ops = []
+        for guild_id in guild_ids:
+            config = GUILD_DATA.get(guild_id)
+            if config is not None:
+                ops.extend(self.guild_ops(guild_id, config))
+        return ops
+
+    def write(self, payload):
+        if not payload:
+            return
+        with self.writer:
+            for sql, params in payload:
+                self.writer.execute(sql, params)
+
+    def write_failed(self):
+        # Транзакция откатилась - следующая запись перепишет серверы целиком
+        self._persisted.clear()
+
+    def load_guild(self, guild_id: int) -> Optional[dict]:
+        if not self.reader.execute("SELECT 1 FROM guilds WHERE guild_id = ?", (guild_id,)).fetchone():
+            return None
+
+        config = {
+            key: value for key, value in DEFAULT_CONFIG.items()
+            if key not in self.COLLECTION_FIELDS
+        }
+        persisted = {'settings': {}, 'registrations': {}, 'titles': {}}
+        for key, value in self.reader.execute("SELECT key, value FROM guild_settings WHERE guild_id = ?", (guild_id,)):
+            config[key] = json.loads(value)
+            persisted['settings'][key] = value
+
+        registered, used_numbers, player_numbers, ordered = [], [], {}, []
+        rows = self.reader.execute(
+            "SELECT user_id, number, reg_order, registered FROM registrations WHERE guild_id = ? "
+            "ORDER BY reg_order IS NULL, reg_order",
+            (guild_id,)
+        )
+        for user_id, number, order, is_registered in rows:
+            persisted['registrations'][user_id] = (number, order, is_registered)
+            if is_registered:
+                registered.append(user_id)
+            if number is not None:
+                used_numbers.append(number)
+                player_numbers[user_id] = number
+            if order is not None:
+                ordered.append(user_id)
+
+        player_titles = {}
+        rows = self.reader.execute(
+            "SELECT user_id, title, owned, equipped FROM titles WHERE guild_id = ? ORDER BY rowid",
+            (guild_id,)
+        )
+        for user_id, title, owned, equipped in rows:
+            persisted['titles'][(user_id, title)] = (owned, equipped)
+            user_titles = player_titles.setdefault(user_id, {'owned': [], 'equipped': None})
+            if owned:
+                user_titles['owned'].append(title)
+            if equipped:
+                user_titles['equipped'] = title
+
+        config.update({
+            'used_numbers': used_numbers,
+            'registered_players': registered,
+            'player_numbers': player_numbers,
+            'registration_order': ordered,
+            'player_titles': player_titles
+        })
+        self._persisted[guild_id] = persisted
+        return config
+
+    def load(self) -> Optional[dict]:
+        self._persisted.clear()
+        guild_count = self.reader.execute("SELECT COUNT(*) FROM guilds").fetchone()[0]
+        if guild_count == 0 and os.path.exists(DATA_FILE):
+            logger.warning(f"⚠️ База SQLite пуста, а {DATA_FILE} существует - перенесите данные: python inkgame.py migrate-sqlite")
+        logger.info(f"🗄️ Серверов в базе SQLite: {guild_count} (загружаются при первом обращении)")
+        return {'guilds': {}, 'version': '2.0'}
+
+def migrate_json_to_sqlite(json_path: str = DATA_FILE, db_path: str = SQLITE_FILE) -> int:
+    """Переносит game_data.json (формат 2.0) в базу SQLite, возвращает число серверов"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if 'guilds' not in data:
+        raise ValueError("Поддерживается только формат 2.0 (с разделом guilds)")
+    if data.get('version') != '2.0':
+        logger.warning(f"⚠️ Версия файла {data.get('version')}, ожидалась 2.0 - пробуем перенести")
+
+    storage = SqliteStorage(db_path)
+    ops = []
+    migrated = 0
+    for guild_id_str, config in data['guilds'].items():
+        try:
+            guild_id = int(guild_id_str)
+        except (ValueError, TypeError):
+            logger.warning(f"⚠️ Неверный guild_id в данных: {guild_id_str}")
+            continue
+        ops.extend(storage.guild_ops(guild_id, GuildState.from_dict(config)))
+        migrated += 1
+    storage.write(ops)
+    return migrated
+
+def create_storage(mode: str) -> JsonStorage:
+    """Создает хранилище для выбранного режима"""
+    if mode == 'journal':
+        return JournalStorage()
+    if mode == 'sharded':
+        return ShardedStorage()
+    if mode == 'sqlite':
+        return SqliteStorage()
+    if mode != 'json':
+        logger.warning(f"⚠️ Неизвестный STORAGE_MODE '{mode}', используется json")
+    return JsonStorage()
+
+STORAGE = create_storage(STORAGE_MODE)
+
+class PersistenceWriter:
+    """Фоновая запись: собирает запросы на сохранение за окно и пишет их одним сбросом"""
+
+    def __init__(self, storage: JsonStorage, window: float):
+        self.storage = storage
+        self.window = window
+        self._pending = set()
+        self._pending_all = False
+        self._waiters = []
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+
+    def request(self, guild_id: Optional[int] = None) -> asyncio.Future:
+        """Ставит сохранение в очередь; future получит True/False после записи на диск"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if guild_id is None:
+            self._pending_all = True
+        else:
+            self._pending.add(guild_id)
+        self._waiters.append(future)
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        return future
+
+    async def _run(self):
+        while self._waiters:
+            await asyncio.sleep(self.window)
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """Немедленно записывает всё накопленное"""
+        async with self._flush_lock:
+            if not self._waiters:
+                return True
+
+            guild_ids = None if self._pending_all else list(self._pending)
+            waiters = self._waiters
+            self._pending = set()
+            self._pending_all = False
+            self._waiters = []
+
+            try:
+                if LEGACY_DATA:
+                    raise RuntimeError("данные старого формата еще не перенесены на сервер - запись отложена")
+                # Снимок берется в потоке событий, на диск пишем в отдельном потоке
+                payload = self.storage.snapshot(guild_ids)
+                await asyncio.to_thread(self.storage.write, payload)
+                logger.info(f"✅ Данные сохранены ({STORAGE_MODE}), запросов объединено: {len(waiters)}")
+                success = True
+            except Exception as e:
+                self.storage.write_failed()
+                logger.error(f"❌ Ошибка сохранения данных: {e}")
+                success = False
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(success)
+            return success
+
+    async def close(self):
+        """Дописывает отложенные сохранения при выключении бота"""
+        # Отменяем только ожидание окна - начатую запись не прерываем
+        if self._task and not self._task.done() and not self._flush_lock.locked():
+            self._task.cancel()
+        await self.flush()
+
+PERSISTENCE = PersistenceWriter(STORAGE, PERSIST_WINDOW)
+
+# Последний отправленный базовый бэкап каждого сервера: {'backup_id', 'config', 'deltas'}
+BACKUP_BASES = {}
+# SHA-256 конфига из последнего отправленного бэкапа каждого сервера
+BACKUP_HASHES = {}
+GZIP_MAGIC = b'\x1f\x8b'
+
+def _backup_config(config: GuildState) -> dict:
+    """Конфиг в том виде, в каком он попадает в файл бэкапа (ключи - строки)"""
+    return json.loads(json.dumps(config.to_dict(), ensure_ascii=False))
+
+def backup_config_hash(config_data: dict) -> str:
+    """SHA-256 канонического JSON конфига - одинаковые данные дают одинаковый хэш"""
+    canonical = json.dumps(config_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def encode_backup_file(backup_data: dict, compress: bool) -> bytes:
+    """Сериализует бэкап в память; при compress - gzip без метки времени (одинаковый вход - одинаковые байты)"""
+    content = json.dumps(backup_data, indent=None if compress else 2, ensure_ascii=False).encode('utf-8')
+    if compress:
+        return gzip.compress(content, mtime=0)
+    return content
+
+def decode_backup_file(data: bytes) -> dict:
+    """Читает файл бэкапа: обычный JSON или JSON в gzip (определяется по сигнатуре)
+
+    Поврежденный gzip дает BadGzipFile (OSError), EOFError или zlib.error.
+    """
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return json.loads(data.decode('utf-8'))
+
+def diff_backup_config(base: dict, current: dict) -> dict:
+    """Поэлементная разница между базовым бэкапом и текущим конфигом
+
+    Множества - add/remove, словари - set/unset, дописанный в конец список - append,
+    всё остальное - value (полная замена поля).
+    """
+    changes = {}
+    for field in current.keys() | base.keys():
+        old = base.get(field)
+        new = current.get(field)
+        if old == new:
+            continue
+        if field in GuildState.SET_FIELDS and isinstance(old, list) and isinstance(new, list):
+            old_set, new_set = set(old), set(new)
+            changes[field] = {'add': sorted(new_set - old_set), 'remove': sorted(old_set - new_set)}
+        elif isinstance(old, dict) and isinstance(new, dict):
+            changes[field] = {
+                'set': {key: value for key, value in new.items() if key not in old or old[key] != value},
+                'unset': [key for key in old if key not in new]
+            }
+        elif isinstance(old, list) and isinstance(new, list) and new[:len(old)] == old:
+            changes[field] = {'append': new[len(old):]}
+        else:
+            changes[field] = {'value': new}
+    return changes
+
+def apply_backup_delta(base: dict, changes: dict) -> dict:
+    """Применяет дельту к конфигу из базового бэкапа, возвращает новый конфиг"""
+    config = dict(base)
+    for field, change in changes.items():
+        if 'value' in change:
+            config[field] = change['value']
+        elif 'append' in change:
+            config[field] = list(config.get(field) or []) + change['append']
+        elif 'add' in change or 'remove' in change:
+            values = set(config.get(field) or [])
+            values.update(change.get('add', []))
+            values.difference_update(change.get('remove', []))
+            config[field] = sorted(values)
+        else:
+            mapping = dict(config.get(field) or {})
+            mapping.update(change.get('set', {}))
+            for key in change.get('unset', []):
+                mapping.pop(key, None)
+            config[field] = mapping
     return config
 
-def convert_sets_to_lists(config: dict) -> dict:
-    """Конвертирует множества в списки для JSON сериализации"""
-    config_copy = config.copy()
-    if isinstance(config_copy.get('used_numbers'), set):
-        config_copy['used_numbers'] = list(config_copy['used_numbers'])
-    if isinstance(config_copy.get('registered_players'), set):
-        config_copy['registered_players'] = list(config_copy['registered_players'])
-    return config_copy
-
-def convert_lists_to_sets(config: dict) -> dict:
-    """Конвертирует списки обратно в множества после загрузки из JSON"""
-    config_copy = config.copy()
-    if isinstance(config_copy.get('used_numbers'), list):
-        config_copy['used_numbers'] = set(config_copy['used_numbers'])
-    if isinstance(config_copy.get('registered_players'), list):
-        config_copy['registered_players'] = set(config_copy['registered_players'])
-    return config_copy
-
-async def send_backup_to_channel(guild_id: int):
-    """Отправляет бэкап в указанный канал с указанием сервера"""
+def build_backup_payload(guild_id: int, config: GuildState, force_base: bool = False):
+    """Готовит содержимое бэкапа: полный базовый или дельту к последней базе
+
+    Возвращает (данные для файла, новое состояние базы для BACKUP_BASES).
+    """
+    now = datetime.datetime.now()
+    current = _backup_config(config)
+    config_hash = backup_config_hash(current)
+    base = BACKUP_BASES.get(guild_id)
+
+    if base is not None and not force_base and base['deltas'] < BACKUP_BASE_EVERY:
+        changes = diff_backup_config(base['config'], current)
+        delta_data = {
+            'type': 'delta',
+            'base_id': base['backup_id'],
+            'seq': base['deltas'] + 1,
+            'guild_id': guild_id,
+            'guild_name': config['guild_name'],
+            'backup_timestamp': str(now),
+            'config_sha256': config_hash,
+            'changes': changes
+        }
+        # Дельта накопительная: если она разрослась до половины базы, выгоднее новая база
+        if len(json.dumps(changes, ensure_ascii=False)) * 2 < base['size']:
+            return delta_data, dict(base, deltas=base['deltas'] + 1)
+
+    backup_id = f"{guild_id}-{now.strftime('%Y%m%d%H%M%S%f')}"
+    base_data = {
+        'type': 'base',
+        'backup_id': backup_id,
+        'guild_id': guild_id,
+        'guild_name': config['guild_name'],
+        'backup_timestamp': str(now),
+        'config_sha256': config_hash,
+        'config': current
+    }
+    size = len(json.dumps(current, ensure_ascii=False))
+    return base_data, {'backup_id': backup_id, 'config': current, 'size': size, 'deltas': 0}
+
+async def send_backup_to_channel(guild_id: int, force_base: bool = False):
+    """Отправляет бэкап в указанный канал с указанием сервера
+
+    Обычно отправляется небольшая дельта к последнему базовому бэкапу;
+    полный бэкап - первый после запуска, каждые BACKUP_BASE_EVERY дельт или force_base.
+    """
     try:
         config = get_guild_config(guild_id)
         backup_channel_id = config.get('backup_channel_id')
@@ -340,226 +2185,371 @@ async def send_backup_to_channel(guild_id: int):
             logger.warning(f"⚠️ BACKUP_CHANNEL_ID не установлен для сервера {config['guild_name']}, пропускаем отправку бэкапа")
             return False
         
-        channel = bot.get_channel(int(backup_channel_id))
+        channel = GUILD_OBJECTS.channel(backup_channel_id)
         if not channel:
             logger.error(f"❌ Канал для бэкапов не найден для сервера {config['guild_name']}")
             return False
         
-        # Создаем временный файл для отправки
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"game_backup_{timestamp}.json"
-        
-        # Создаем бэкап только для этого сервера
-        backup_data = {
-            'guild_id': guild_id,
-            'guild_name': config['guild_name'],
-            'backup_timestamp': str(datetime.datetime.now()),
-            'config': convert_sets_to_lists(config)
-        }
-        
-        # Сохраняем временный файл
-        with open(backup_filename, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, ensure_ascii=False)
+        backup_data, new_base = build_backup_payload(guild_id, config, force_base)
+        is_delta = backup_data['type'] == 'delta'
+        config_hash = backup_data['config_sha256']
         
-        # Создаем embed с информацией о бэкапе
-        embed = discord.Embed(
-            title="💾 АВТОМАТИЧЕСКИЙ БЭКАП",
-            description=f"Создан автоматический бэкап данных игры для сервера **{config['guild_name']}**",
-            color=0x00ff00,
-            timestamp=datetime.datetime.now()
-        )
-        
-        embed.add_field(
-            name="📊 Статистика сервера",
-            value=(
-                f"• Игроков: {len(config['registered_players'])}\n"
-                f"• Номеров: {len(config['used_numbers'])}\n"
-                f"• Титулов: {len(config['player_titles'])}\n"
-                f"• Регистрация: {'Открыта' if config['registration_open'] else 'Закрыта'}\n"
-                f"• Игра: {'Активна' if config['game_active'] else 'Неактивна'}"
-            ),
-            inline=True
-        )
+        # Данные не изменились с последнего отправленного бэкапа - повторно не загружаем
+        if not force_base and BACKUP_HASHES.get(guild_id) == config_hash:
+            logger.info(f"⏭️ Бэкап для сервера {config['guild_name']} не изменился, отправка пропущена")
+            return True
         
-        embed.add_field(
-            name="⚙️ Настройки сервера",
-            value=(
-                f"• Макс. игроков: {config['max_players']}\n"
-                f"• Награда: {config['reward_amount']:,}$\n"
-                f"• Номера: {config['min_number']:03d}-{config['max_number']:03d}"
-            ),
-            inline=True
-        )
+        # Файл собирается в памяти; имя уникально благодаря серверу, микросекундам и хэшу
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        suffix = f"_delta{backup_data['seq']}" if is_delta else ""
+        extension = ".json.gz" if BACKUP_COMPRESS else ".json"
+        backup_filename = f"game_backup_{guild_id}_{timestamp}_{config_hash[:8]}{suffix}{extension}"
+        content = encode_backup_file(backup_data, BACKUP_COMPRESS)
         
-        embed.add_field(
-            name="🕐 Время создания",
-            value=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            inline=False
-        )
+        if is_delta:
+            changed = ", ".join(sorted(backup_data['changes'])) or "нет изменений"
+            embed = discord.Embed(
+                title="💾 ИНКРЕМЕНТАЛЬНЫЙ БЭКАП",
+                description=(
+                    f"Изменения с последнего полного бэкапа сервера **{config['guild_name']}**\n"
+                    f"Для восстановления: `/restore` с базовым бэкапом и этим файлом"
+                ),
+                color=0x00ff00,
+                timestamp=datetime.datetime.now()
+            )
+            embed.add_field(
+                name="📦 Дельта",
+                value=(
+                    f"• База: `{backup_data['base_id']}`\n"
+                    f"• Номер: {backup_data['seq']}/{BACKUP_BASE_EVERY}\n"
+                    f"• Поля: {changed}"
+                ),
+                inline=False
+            )
+        else:
+            # Создаем embed с информацией о бэкапе
+            embed = discord.Embed(
+                title="💾 АВТОМАТИЧЕСКИЙ БЭКАП",
+                description=f"Создан автоматический бэкап данных игры для сервера **{config['guild_name']}**",
+                color=0x00ff00,
+                timestamp=datetime.datetime.now()
+            )
+            
+            embed.add_field(
+                name="📊 Статистика сервера",
+                value=(
+                    f"• Игроков: {len(config['registered_players'])}\n"
+                    f"• Номеров: {len(config['used_numbers'])}\n"
+                    f"• Титулов: {len(config['player_titles'])}\n"
+                    f"• Регистрация: {'Открыта' if config['registration_open'] else 'Закрыта'}\n"
+                    f"• Игра: {'Активна' if config['game_active'] else 'Неактивна'}"
+                ),
+                inline=True
+            )
+            
+            embed.add_field(
+                name="⚙️ Настройки сервера",
+                value=(
+                    f"• Макс. игроков: {config['max_players']}\n"
+                    f"• Награда: {config['reward_amount']:,}$\n"
+                    f"• Номера: {config['min_number']:03d}-{config['max_number']:03d}"
+                ),
+                inline=True
+            )
+            
+            embed.add_field(
+                name="🕐 Время создания",
+                value=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                inline=False
+            )
         
         embed.set_footer(text=f"Автоматическая система бэкапов • {config['guild_name']}")
         
-        # Отправляем файл
-        file = discord.File(backup_filename, filename=backup_filename)
+        # Отправляем файл прямо из памяти
+        file = discord.File(io.BytesIO(content), filename=backup_filename)
         await channel.send(embed=embed, file=file)
         
-        # Удаляем временный файл
-        os.remove(backup_filename)
+        # Базу запоминаем только после успешной отправки - дельты должны ссылаться на то, что есть в канале
+        BACKUP_BASES[guild_id] = new_base
+        BACKUP_HASHES[guild_id] = config_hash
         
-        logger.info(f"✅ Бэкап отправлен в канал для сервера {config['guild_name']}")
+        logger.info(f"✅ {'Дельта-бэкап' if is_delta else 'Бэкап'} отправлен в канал для сервера {config['guild_name']}")
         return True
             
     except Exception as e:
         logger.error(f"❌ Ошибка отправки бэкапа для сервера {guild_id}: {e}")
         return False
 
-async def save_data_with_backup(guild_id: int):
-    """Сохраняет данные и создает резервную копию с отправкой в канал"""
-    if await save_data():
-        # Отправляем бэкап в канал
-        await send_backup_to_channel(guild_id)
-        return True
-    return False
+class BackupScheduler:
+    """Автоматические бэкапы вне команд: не чаще одного на сервер за интервал, всегда актуальные данные"""
 
-async def save_data():
-    """Сохраняет данные всех серверов в файл"""
-    try:
-        save_data = {
-            'guilds': {},
-            'saved_at': str(datetime.datetime.now()),
-            'version': '2.0'
-        }
-        
-        # Конвертируем данные каждого сервера
-        for guild_id, config in GUILD_DATA.items():
-            save_data['guilds'][str(guild_id)] = convert_sets_to_lists(config)
-        
-        temp_filename = 'game_data_temp.json'
-        with open(temp_filename, 'w', encoding='utf-8') as f:
-            json.dump(save_data, f, indent=2, ensure_ascii=False)
-        
-        if os.path.exists('game_data.json'):
-            os.replace(temp_filename, 'game_data.json')
-        else:
-            os.rename(temp_filename, 'game_data.json')
-            
-        logger.info("✅ Данные всех серверов сохранены")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Ошибка сохранения данных: {e}")
-        try:
-            if os.path.exists('game_data_temp.json'):
-                os.remove('game_data_temp.json')
-        except:
-            pass
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = set()
+        self._tasks = {}
+        self._locks = {}
+        self._last_attempt = {}
+        self.last_success = {}
+        self._closing = False
+
+    def request(self, guild_id: int):
+        """Отмечает, что данные сервера изменились; бэкап уйдет, когда истечет интервал"""
+        self._pending.add(guild_id)
+        task = self._tasks.get(guild_id)
+        if task is None or task.done():
+            self._tasks[guild_id] = asyncio.get_running_loop().create_task(self._run(guild_id))
+
+    def last_backup_time(self, guild_id: int) -> Optional[datetime.datetime]:
+        """Время последнего успешно отправленного бэкапа (None - еще не было)"""
+        return self.last_success.get(guild_id)
+
+    async def _run(self, guild_id: int):
+        while guild_id in self._pending and not self._closing:
+            delay = self._last_attempt.get(guild_id, float('-inf')) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._upload(guild_id)
+
+    async def _upload(self, guild_id: int, force_base: bool = False) -> bool:
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            # Снимаем отметку до отправки: изменения во время загрузки попадут в следующий бэкап
+            self._pending.discard(guild_id)
+            self._last_attempt[guild_id] = time.monotonic()
+            success = await send_backup_to_channel(guild_id, force_base)
+            if success:
+                self.last_success[guild_id] = datetime.datetime.now()
+            return success
+
+    async def backup_now(self, guild_id: int, force_base: bool = True) -> bool:
+        """Отправляет бэкап сразу, минуя интервал (ручной /backup, перед восстановлением)"""
+        return await self._upload(guild_id, force_base)
+
+    async def close(self):
+        """Отправляет отложенные бэкапы при выключении бота"""
+        self._closing = True
+        for guild_id, task in self._tasks.items():
+            # Прерываем только ожидание интервала - начатую отправку дожидаемся
+            if not task.done() and not self._locks.get(guild_id, asyncio.Lock()).locked():
+                task.cancel()
+        running = [task for task in self._tasks.values() if not task.done()]
+        await asyncio.gather(*running, return_exceptions=True)
+        await asyncio.gather(*(self._upload(guild_id) for guild_id in list(self._pending)), return_exceptions=True)
+
+BACKUPS = BackupScheduler(BACKUP_INTERVAL)
+
+async def save_data_with_backup(guild_id: int, wait: bool = False):
+    """Сохраняет данные и ставит бэкап в очередь на отправку в канал
+
+    По умолчанию не ждет записи на диск - она идет в фоне (wait=True - дождаться).
+    Сам бэкап уходит из BackupScheduler не чаще раза в BACKUP_INTERVAL.
+    """
+    saved = request_save(guild_id)
+    if wait and not await saved:
         return False
+    BACKUPS.request(guild_id)
+    return True
+
+def request_save(guild_id: Optional[int] = None) -> asyncio.Future:
+    """Ставит сохранение в фоновую запись; результат можно дождаться через await"""
+    return PERSISTENCE.request(guild_id)
+
+async def save_data(guild_id: Optional[int] = None):
+    """Сохраняет данные (guild_id - какой сервер изменился, None - все) и ждет записи на диск"""
+    return await request_save(guild_id)
 
-async def restore_from_backup(backup_config_data, guild_id: int):
-    """Восстанавливает данные из бэкапа для конкретного сервера"""
+# Поля, которые /restore берет из бэкапа; остальные (канал бэкапов, диапазон номеров...) остаются текущими
+RESTORE_FIELDS = (
+    'used_numbers', 'registered_players', 'player_numbers', 'player_titles', 'registration_order',
+    'leaderboard_message_id', 'leaderboard_channel_id', 'registration_open', 'game_active',
+    'prizes_distributed', 'max_players', 'reward_amount', 'language'
+)
+REQUIRED_BACKUP_FIELDS = ('used_numbers', 'registered_players', 'player_numbers', 'player_titles')
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _backup_user_id(value, field: str, errors: list) -> Optional[int]:
     try:
-        # Сохраняем текущие данные как резервную копию перед восстановлением
-        await save_data_with_backup(guild_id)
-        
-        config = get_guild_config(guild_id)
-        
-        # Очищаем текущие данные
-        config['used_numbers'].clear()
-        config['registered_players'].clear()
-        config['player_numbers'].clear()
-        config['player_titles'].clear()
-        config['registration_order'].clear()
-        
-        # Восстанавливаем used_numbers
-        if 'used_numbers' in backup_config_data:
-            if isinstance(backup_config_data['used_numbers'], list):
-                config['used_numbers'] = set(backup_config_data['used_numbers'])
+        return int(value)
+    except (ValueError, TypeError):
+        errors.append(f"{field}: неверный ID пользователя {value!r}")
+        return None
+
+def validate_backup_config(backup_config_data) -> tuple:
+    """Проверяет данные бэкапа целиком и приводит их к внутреннему виду
+
+    Не останавливается на первой ошибке. Возвращает (поля для восстановления, список ошибок).
+    """
+    if not isinstance(backup_config_data, dict):
+        return {}, ["данные бэкапа должны быть объектом JSON"]
+
+    errors = [f"{field}: поле отсутствует" for field in REQUIRED_BACKUP_FIELDS if field not in backup_config_data]
+    restored = {}
+
+    for field in ('used_numbers', 'registered_players', 'registration_order'):
+        if field not in backup_config_data:
+            continue
+        values = backup_config_data[field]
+        if not isinstance(values, list):
+            errors.append(f"{field}: ожидается список")
+            continue
+        if field == 'used_numbers':
+            bad = [value for value in values if not _is_int(value) or value < 0]
+            errors.extend(f"used_numbers: неверный номер {value!r}" for value in bad)
+            restored[field] = set(values) if not bad else set()
+        else:
+            user_ids = [_backup_user_id(value, field, errors) for value in values]
+            restored[field] = set(user_ids) if field == 'registered_players' else user_ids
+
+    player_numbers = backup_config_data.get('player_numbers', {})
+    if not isinstance(player_numbers, dict):
+        errors.append("player_numbers: ожидается объект")
+    else:
+        restored['player_numbers'] = {}
+        owners = {}
+        for user_id_str, number in player_numbers.items():
+            user_id = _backup_user_id(user_id_str, 'player_numbers', errors)
+            # Старые бэкапы хранят номера строками "007", новые - числами
+            if isinstance(number, str) and number.isdigit():
+                number = int(number)
+            elif not _is_int(number):
+                errors.append(f"player_numbers: неверный номер {number!r} у {user_id_str}")
+                continue
+            if number in owners:
+                errors.append(f"player_numbers: номер {format_number(number)} у {owners[number]} и {user_id_str}")
+            owners[number] = user_id_str
+            restored['player_numbers'][user_id] = number
+
+    player_titles = backup_config_data.get('player_titles', {})
+    if not isinstance(player_titles, dict):
+        errors.append("player_titles: ожидается объект")
+    else:
+        restored['player_titles'] = {}
+        for user_id_str, title_data in player_titles.items():
+            user_id = _backup_user_id(user_id_str, 'player_titles', errors)
+            if isinstance(title_data, str):
+                title_data = {'owned': [title_data], 'equipped': title_data}
+            elif not (
+                isinstance(title_data, dict)
+                and isinstance(title_data.get('owned'), list)
+                and all(isinstance(title, str) for title in title_data['owned'])
+                and (title_data.get('equipped') is None or isinstance(title_data['equipped'], str))
+            ):
+                errors.append(f"player_titles: неверные титулы у {user_id_str}")
+                continue
+            restored['player_titles'][user_id] = {'owned': list(title_data['owned']), 'equipped': title_data.get('equipped')}
+
+    for field in ('leaderboard_message_id', 'leaderboard_channel_id'):
+        if field in backup_config_data:
+            value = backup_config_data[field]
+            if value is None or _is_int(value):
+                restored[field] = value
             else:
-                config['used_numbers'] = set(backup_config_data['used_numbers'])
-        
-        # Восстанавливаем registered_players
-        if 'registered_players' in backup_config_data:
-            if isinstance(backup_config_data['registered_players'], list):
-                config['registered_players'] = set(backup_config_data['registered_players'])
+                errors.append(f"{field}: ожидается ID или null")
+
+    for field in ('registration_open', 'game_active', 'prizes_distributed'):
+        if field in backup_config_data:
+            if isinstance(backup_config_data[field], bool):
+                restored[field] = backup_config_data[field]
             else:
-                config['registered_players'] = set(backup_config_data['registered_players'])
-        
-        # Восстанавливаем player_numbers
-        if 'player_numbers' in backup_config_data:
-            config['player_numbers'] = {}
-            for user_id_str, number_str in backup_config_data['player_numbers'].items():
-                try:
-                    user_id = int(user_id_str)
-                    config['player_numbers'][user_id] = number_str
-                except (ValueError, TypeError):
-                    logger.warning(f"⚠️ Неверный user_id в бэкапе: {user_id_str}")
-                    continue
-        
-        # Восстанавливаем player_titles
-        if 'player_titles' in backup_config_data:
-            config['player_titles'] = {}
-            for user_id_str, title_data in backup_config_data['player_titles'].items():
-                try:
-                    user_id = int(user_id_str)
-                    if isinstance(title_data, str):
-                        config['player_titles'][user_id] = {
-                            'owned': [title_data],
-                            'equipped': title_data
-                        }
-                    else:
-                        config['player_titles'][user_id] = title_data
-                except (ValueError, TypeError):
-                    logger.warning(f"⚠️ Неверный user_id в бэкапе титулов: {user_id_str}")
-                    continue
-        
-        # Восстанавливаем registration_order
-        if 'registration_order' in backup_config_data:
-            config['registration_order'] = backup_config_data['registration_order']
-        else:
-            config['registration_order'] = list(config['registered_players'])
-        
-        # Восстанавливаем лидерборд
-        if 'leaderboard_message_id' in backup_config_data:
-            config['leaderboard_message_id'] = backup_config_data['leaderboard_message_id']
-        if 'leaderboard_channel_id' in backup_config_data:
-            config['leaderboard_channel_id'] = backup_config_data['leaderboard_channel_id']
-        
-        # Восстанавливаем флаги
-        if 'registration_open' in backup_config_data:
-            config['registration_open'] = backup_config_data['registration_open']
-        if 'game_active' in backup_config_data:
-            config['game_active'] = backup_config_data['game_active']
-        if 'prizes_distributed' in backup_config_data:
-            config['prizes_distributed'] = backup_config_data['prizes_distributed']
+                errors.append(f"{field}: ожидается true/false")
+    restored.setdefault('prizes_distributed', False)
+
+    for field in ('max_players', 'reward_amount'):
+        if field in backup_config_data:
+            if _is_int(backup_config_data[field]) and backup_config_data[field] >= 0:
+                restored[field] = backup_config_data[field]
+            else:
+                errors.append(f"{field}: ожидается неотрицательное число")
+
+    if 'language' in backup_config_data:
+        if backup_config_data['language'] in LOCALIZATIONS:
+            restored['language'] = backup_config_data['language']
         else:
-            config['prizes_distributed'] = False
-        
-        # Восстанавливаем настройки
-        if 'max_players' in backup_config_data:
-            config['max_players'] = backup_config_data['max_players']
-        if 'reward_amount' in backup_config_data:
-            config['reward_amount'] = backup_config_data['reward_amount']
-        
-        # Восстанавливаем язык
-        if 'language' in backup_config_data:
-            config['language'] = backup_config_data['language']
-        
-        # Сохраняем восстановленные данные
-        await save_data()
-        
-        logger.info(f"✅ Данные восстановлены из бэкапа для сервера {config['guild_name']}")
-        return True
+            errors.append(f"language: неизвестный язык {backup_config_data['language']!r}")
+
+    if 'registration_order' not in restored and 'registered_players' in restored:
+        restored['registration_order'] = list(restored['registered_players'])
+
+    return restored, errors
+
+def build_restored_state(backup_config_data, current_data: dict) -> tuple:
+    """Собирает новое состояние сервера из бэкапа; выполняется в потоке и не трогает живые данные
+
+    current_data - поля текущего состояния, которые бэкап не перезаписывает.
+    Возвращает (GuildState или None, список ошибок).
+    """
+    restored, errors = validate_backup_config(backup_config_data)
+    if errors:
+        return None, errors
+    data = dict(current_data)
+    data.update(restored)
+    state = GuildState.from_dict(data)
+    # Новое состояние нигде еще не сохранено - пишем его целиком
+    state.mark_dirty(*GuildState.FIELDS)
+    return state, []
+
+async def restore_from_backup(backup_config_data, guild_id: int) -> dict:
+    """Восстанавливает данные из бэкапа для конкретного сервера
+
+    Бэкап проверяется и собирается в новое состояние вне потока событий, затем
+    подменяет текущее одним присваиванием - наполовину восстановленного сервера не бывает.
+    Возвращает {'success', 'errors', 'timings'} (timings - секунды по этапам).
+    """
+    timings = {}
+    try:
+        async with guild_lock(guild_id):
+            config = get_guild_config(guild_id)
+            current_data = {field: value for field, value in config.to_dict().items() if field not in RESTORE_FIELDS}
+            
+            started = time.perf_counter()
+            new_state, errors = await asyncio.to_thread(build_restored_state, backup_config_data, current_data)
+            timings['Проверка и сборка'] = time.perf_counter() - started
+            if errors:
+                logger.warning(f"⚠️ Бэкап для сервера {config['guild_name']} не прошел проверку: {len(errors)} ошибок")
+                return {'success': False, 'errors': errors, 'timings': timings}
+            
+            # Сохраняем текущие данные как резервную копию перед восстановлением
+            # (сразу и полностью - отложенный бэкап ушел бы уже с восстановленными данными)
+            started = time.perf_counter()
+            request_save(guild_id)
+            await BACKUPS.backup_now(guild_id)
+            timings['Бэкап текущих данных'] = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            GUILD_DATA[guild_id] = new_state
+            timings['Замена данных'] = time.perf_counter() - started
+            
+            # Сохраняем восстановленные данные
+            started = time.perf_counter()
+            saved = await save_data(guild_id)
+            timings['Сохранение'] = time.perf_counter() - started
+            
+            logger.info(
+                f"✅ Данные восстановлены из бэкапа для сервера {new_state['guild_name']} "
+                f"({', '.join(f'{phase}: {seconds * 1000:.1f} мс' for phase, seconds in timings.items())})"
+            )
+            errors = [] if saved else ["данные восстановлены в памяти, но не записаны на диск"]
+            return {'success': True, 'errors': errors, 'timings': timings}
         
     except Exception as e:
         logger.error(f"❌ Ошибка восстановления из бэкапа для сервера {guild_id}: {e}")
-        return False
-        
+        return {'success': False, 'errors': [str(e)], 'timings': timings}
+
+def format_restore_errors(errors: list, limit: int = 15) -> str:
+    """Список ошибок проверки бэкапа для embed (длинные списки обрезаются)"""
+    lines = [f"• {error}" for error in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"• ... и еще {len(errors) - limit}")
+    return "\n".join(lines)
+
 async def restore_players_from_roles(guild, config: dict):
     """Восстанавливает игроков из ролей для конкретного сервера"""
     try:
         logger.info(f"🔄 Проверка игроков с ролью '{config['registration_role_name']}' на сервере {guild.name}...")
         
-        role = discord.utils.get(guild.roles, name=config['registration_role_name'])
+        role = GUILD_OBJECTS.registration_role(guild, config)
         if not role:
             logger.info(f"⚠️ Роль '{config['registration_role_name']}' не найдена на сервере {guild.name}")
             return
@@ -574,30 +2564,29 @@ async def restore_players_from_roles(guild, config: dict):
                 number_match = re.search(r'\((\d{3})\)$', member.display_name)
                 if number_match:
                     player_number = int(number_match.group(1))
-                    formatted_number = f"{player_number:03d}"
                     
-                    # Проверяем, не занят ли номер
-                    if player_number in config['used_numbers']:
-                        # Генерируем новый номер
-                        while True:
-                            player_number = random.randint(config['min_number'], config['max_number'])
-                            if player_number not in config['used_numbers']:
-                                break
-                        formatted_number = f"{player_number:03d}"
+                    # Номер из ника может быть уже у другого игрока (или просто занят) - выдаем новый
+                    owner = config['player_numbers'].owner(player_number)
+                    if (owner is not None and owner != member.id) or not config.reserve_number(player_number):
+                        player_number = config.allocate_number()
+                        if player_number is None:
+                            logger.warning(f"⚠️ Нет свободных номеров для {member.display_name} на сервере {guild.name}")
+                            continue
                     
-                    config['used_numbers'].add(player_number)
                     config['registered_players'].add(member.id)
-                    config['player_numbers'][member.id] = formatted_number
+                    config['player_numbers'][member.id] = player_number
                     
                     if member.id not in config['registration_order']:
                         config['registration_order'].append(member.id)
+                    config.mark_dirty('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
                     
                     restored_count += 1
-                    logger.info(f"✅ Восстановлен игрок {member.display_name} с номером {formatted_number} на сервере {guild.name}")
+                    logger.info(f"✅ Восстановлен игрок {member.display_name} с номером {format_number(player_number)} на сервере {guild.name}")
         
         if restored_count > 0:
+            PLAYER_SEARCH.invalidate(guild.id)
             logger.info(f"✅ Восстановлено {restored_count} игроков из ролей на сервере {guild.name}")
-            await save_data()
+            await save_data(guild.id)
         else:
             logger.info(f"ℹ️ Новых игроков для восстановления не найдено на сервере {guild.name}")
             
@@ -607,14 +2596,13 @@ async def restore_players_from_roles(guild, config: dict):
 def load_data():
     """Загружает данные всех серверов из файла"""
     try:
-        if not os.path.exists('game_data.json'):
+        data = STORAGE.load()
+        if data is None:
             logger.info("ℹ️ Файл данных не найден, начинаем с чистого листа")
             return True
-            
-        with open('game_data.json', 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+
         GUILD_DATA.clear()
+        LEGACY_DATA.clear()
         
         # Проверяем версию формата
         if 'guilds' in data:
@@ -622,20 +2610,16 @@ def load_data():
             for guild_id_str, config in data['guilds'].items():
                 try:
                     guild_id = int(guild_id_str)
-                    GUILD_DATA[guild_id] = convert_lists_to_sets(config)
+                    GUILD_DATA[guild_id] = GuildState.from_dict(config)
                 except (ValueError, TypeError):
                     logger.warning(f"⚠️ Неверный guild_id в данных: {guild_id_str}")
                     continue
         else:
             # Старый формат - конвертируем в новый
             logger.info("🔄 Конвертируем старый формат данных в новый...")
-            old_config = convert_lists_to_sets(data)
-            # Предполагаем, что старые данные относятся к первому серверу бота
-            if bot.guilds:
-                first_guild = bot.guilds[0]
-                old_config['guild_name'] = first_guild.name
-                GUILD_DATA[first_guild.id] = old_config
-                logger.info(f"✅ Старые данные перенесены на сервер {first_guild.name}")
+            LEGACY_DATA['config'] = GuildState.from_dict(data)
+            # При загрузке из setup_hook серверов еще нет - перенос доделает on_ready
+            attach_legacy_data()
         
         logger.info("✅ Данные загружены")
         logger.info(f"📊 Загружено серверов: {len(GUILD_DATA)}")
@@ -648,6 +2632,18 @@ def load_data():
         GUILD_DATA.clear()
         return False
 
+def attach_legacy_data() -> bool:
+    """Переносит данные старого формата на первый сервер бота, когда список серверов известен"""
+    if 'config' not in LEGACY_DATA or not bot.guilds:
+        return False
+    old_config = LEGACY_DATA.pop('config')
+    # Предполагаем, что старые данные относятся к первому серверу бота
+    first_guild = bot.guilds[0]
+    old_config['guild_name'] = first_guild.name
+    GUILD_DATA[first_guild.id] = old_config
+    logger.info(f"✅ Старые данные перенесены на сервер {first_guild.name}")
+    return True
+
 def remove_number_from_nick(nickname: Optional[str]) -> str:
     """Удаляет номер из ника в формате (123)"""
     if nickname:
@@ -701,6 +2697,16 @@ async def get_user_balance(guild_id: int, user_id: int):
     except Exception as e:
         return False, f"Ошибка соединения: {e}"
 
+# guild_id -> (channel_id, message_id, отпечаток embed'а последней успешной правки)
+LEADERBOARD_FINGERPRINTS = {}
+# Правки сообщений лидерборда: сделано и пропущено (содержимое не изменилось)
+LEADERBOARD_EDIT_STATS = collections.Counter(performed=0, avoided=0)
+
+def embed_fingerprint(embed) -> str:
+    """SHA-256 видимого содержимого embed'а - одинаков для одинаково выглядящих embed'ов"""
+    payload = json.dumps(embed.to_dict(), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
 async def update_leaderboard(guild_id: int):
     """Обновляет сообщение лидерборда для конкретного сервера"""
     config = get_guild_config(guild_id)
@@ -709,18 +2715,35 @@ async def update_leaderboard(guild_id: int):
         return
     
     try:
-        channel = bot.get_channel(config['leaderboard_channel_id'])
-        if not channel:
+        message = GUILD_OBJECTS.leaderboard_message(guild_id, config)
+        if not message:
             logger.warning(f"❌ Канал лидерборда не найден для сервера {config['guild_name']}")
             return
         
-        message = await channel.fetch_message(config['leaderboard_message_id'])
-        
         embed = await create_leaderboard_embed(guild_id)
-        await message.edit(embed=embed)
+        
+        # Сообщение уже показывает ровно это - правка ничего не изменит, бережем лимиты Discord
+        fingerprint = (config['leaderboard_channel_id'], config['leaderboard_message_id'], embed_fingerprint(embed))
+        if LEADERBOARD_FINGERPRINTS.get(guild_id) == fingerprint:
+            LEADERBOARD_EDIT_STATS['avoided'] += 1
+            logger.info(f"ℹ️ Лидерборд сервера {config['guild_name']} не изменился, правка пропущена")
+            return
+        
+        view = LeaderboardView.for_page(1, leaderboard_total_pages(config))
+        try:
+            # Правим по сохраненным ID одним запросом
+            await message.edit(embed=embed, view=view)
+        except discord.NotFound:
+            # Проверяем, что сообщения действительно нет; NotFound отсюда сбросит настройки
+            GUILD_OBJECTS.forget_leaderboard(guild_id)
+            message = await message.channel.fetch_message(message.id)
+            await message.edit(embed=embed, view=view)
+        LEADERBOARD_FINGERPRINTS[guild_id] = fingerprint
+        LEADERBOARD_EDIT_STATS['performed'] += 1
         logger.info(f"✅ Лидерборд обновлен для сервера {config['guild_name']}")
         
     except discord.NotFound:
+        LEADERBOARD_FINGERPRINTS.pop(guild_id, None)
         logger.warning(f"❌ Сообщение лидерборда не найдено для сервера {config['guild_name']}, сбрасываем настройки")
         config['leaderboard_message_id'] = None
         config['leaderboard_channel_id'] = None
@@ -728,9 +2751,23 @@ async def update_leaderboard(guild_id: int):
     except Exception as e:
         logger.error(f"❌ Ошибка обновления лидерборда для сервера {config['guild_name']}: {e}")
 
+def leaderboard_total_pages(config: GuildState) -> int:
+    return max(1, (len(config['registration_order']) + 9) // 10)
+
 async def create_leaderboard_embed(guild_id: int, page: int = 1):
-    """Создает embed для лидерборда конкретного сервера"""
+    """Embed лидерборда сервера; после изменений строится заново, иначе берется из кэша"""
     config = get_guild_config(guild_id)
+    if page < 1 or page > leaderboard_total_pages(config):
+        page = 1
+    # Строки "Unknown User" появляются, пока пользователя нет в кэше - такую страницу не запоминаем
+    unknown = []
+    return await RENDERS.render(
+        guild_id, 'leaderboard', page, config,
+        lambda: build_leaderboard_embed(config, page, unknown), cacheable=lambda: not unknown
+    )
+
+def build_leaderboard_embed(config: GuildState, page: int = 1, unknown: Optional[list] = None):
+    """Создает embed для лидерборда конкретного сервера; ID ненайденных пользователей - в unknown"""
     
     if not config['registration_order']:
         return discord.Embed(
@@ -754,10 +2791,10 @@ async def create_leaderboard_embed(guild_id: int, page: int = 1):
     
     leaderboard_text = ""
     
-    for i in range(start_index, end_index):
-        user_id = config['registration_order'][i]
+    # Срез страницы - O(log n + 10), без перебора игроков до нее
+    for i, user_id in enumerate(config['registration_order'][start_index:end_index], start_index):
         user = bot.get_user(user_id)
-        player_number = config['player_numbers'].get(user_id, "???")
+        player_number = format_number(config['player_numbers'].get(user_id))
         
         # Добавляем медальки для первых трех мест
         medal = ""
@@ -779,6 +2816,8 @@ async def create_leaderboard_embed(guild_id: int, page: int = 1):
                 leaderboard_text += f"`#{i+1:2d}` {medal} {user.display_name} ({player_number})\n"
         else:
             leaderboard_text += f"`#{i+1:2d}` {medal} Unknown User ({player_number})\n"
+            if unknown is not None:
+                unknown.append(user_id)
     
     embed.add_field(
         name=f"🎮 Игроки ({start_index + 1}-{end_index})",
@@ -803,6 +2842,84 @@ async def create_leaderboard_embed(guild_id: int, page: int = 1):
     
     return embed
 
+# Текущая страница берется из подвала embed'а: "Страница 2/9 • Лидерборд • ..."
+LEADERBOARD_PAGE_RE = re.compile(r'Страница (\d+)/(\d+)')
+
+def leaderboard_page_of(message) -> int:
+    """Страница лидерборда, которую показывает сообщение"""
+    if message is not None and message.embeds:
+        match = LEADERBOARD_PAGE_RE.search(message.embeds[0].footer.text or '')
+        if match:
+            return int(match.group(1))
+    return 1
+
+async def show_leaderboard_page(interaction: discord.Interaction, page: int):
+    """Показывает страницу лидерборда одним ответом на нажатие; страница берется из кэша рендера"""
+    config = get_guild_config(interaction.guild.id, interaction.guild.name)
+    total_pages = leaderboard_total_pages(config)
+    page = min(max(1, page), total_pages)
+    embed = await create_leaderboard_embed(interaction.guild.id, page)
+    view = LeaderboardView.for_page(page, total_pages)
+    if interaction.message is not None and interaction.message.id == config['leaderboard_message_id']:
+        # Закрепленный лидерборд общий - листаем в личной копии, не меняя его для всех
+        await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    else:
+        await interaction.response.edit_message(embed=embed, view=view)
+
+class LeaderboardJumpModal(discord.ui.Modal):
+    """Переход к странице лидерборда по номеру"""
+
+    def __init__(self, total_pages: int):
+        super().__init__(title="Перейти к странице")
+        self.page_input = discord.ui.TextInput(
+            label=f"Номер страницы (1-{total_pages})",
+            placeholder="1",
+            max_length=6
+        )
+        self.add_item(self.page_input)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        value = self.page_input.value.strip()
+        if not value.isdigit():
+            await interaction.response.send_message("❌ Введите номер страницы числом", ephemeral=True)
+            return
+        await show_leaderboard_page(interaction, int(value))
+
+class LeaderboardView(discord.ui.View):
+    """Кнопки листания лидерборда: постоянные custom_id, без таймаута - переживают перезапуск
+
+    Состояние не хранится: страница читается из подвала сообщения, на котором нажали кнопку.
+    Для каждой отправки или правки создается свой экземпляр - View изменяемый, и discord.py
+    привязывает его к сообщению; общий на все сообщения здесь только экземпляр из setup_hook.
+    """
+
+    def __init__(self, has_previous: bool = True, has_next: bool = True):
+        super().__init__(timeout=None)
+        self.previous_page.disabled = not has_previous
+        self.next_page.disabled = not has_next
+        self.jump_to_page.disabled = not (has_previous or has_next)
+
+    @classmethod
+    def for_page(cls, page: int, total_pages: int) -> 'LeaderboardView':
+        """Новый набор кнопок для страницы page"""
+        return cls(page > 1, page < total_pages)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.guild is not None
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary, custom_id="inkgame:leaderboard:previous")
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await show_leaderboard_page(interaction, leaderboard_page_of(interaction.message) - 1)
+
+    @discord.ui.button(emoji="🔢", style=discord.ButtonStyle.secondary, custom_id="inkgame:leaderboard:jump")
+    async def jump_to_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        await interaction.response.send_modal(LeaderboardJumpModal(leaderboard_total_pages(config)))
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary, custom_id="inkgame:leaderboard:next")
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await show_leaderboard_page(interaction, leaderboard_page_of(interaction.message) + 1)
+
 async def safe_send_response(interaction, *args, **kwargs):
     """Безопасная отправка ответа с обработкой ошибок взаимодействий"""
     try:
@@ -858,6 +2975,12 @@ async def safe_defer_response(interaction, ephemeral=False):
         logger.warning(f"⚠️ Не удалось отложить ответ: {e}")
         return False
 
+async def safe_reply(interaction, **kwargs):
+    """Отвечает одним запросом: правит отложенный ответ или сразу отправляет эфемерный"""
+    if interaction.response.is_done():
+        return await safe_edit_response(interaction, **kwargs)
+    return await safe_send_response(interaction, ephemeral=True, **kwargs)
+
 async def auto_update_leaderboard(guild_id: int):
     """Автоматически обновляет лидерборд с обработкой ошибок"""
     try:
@@ -866,21 +2989,92 @@ async def auto_update_leaderboard(guild_id: int):
     except Exception as e:
         logger.error(f"❌ Ошибка автоматического обновления лидерборда для сервера {guild_id}: {e}")
 
-async def distribute_prizes(guild_id: int, config: dict):
-    """Распределяет призы за первые три места"""
-    if not config['registration_order'] or len(config['registration_order']) < 3:
+class LeaderboardRefresher:
+    """Обновление лидербордов после изменений: не чаще раза на сервер за интервал
+
+    Команды только отмечают лидерборд устаревшим. Все отметки за интервал схлопываются
+    в одно редактирование сообщения, которое строится из состояния на момент отправки.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = set()
+        self._tasks = {}
+        self._locks = {}
+        self._last_refresh = {}
+        # guild_id -> {'requested': отметок, 'refreshed': автоматических правок, 'forced': ручных}
+        self._stats = {}
+        self._closing = False
+
+    def request(self, guild_id: int):
+        """Отмечает лидерборд сервера устаревшим; правка уйдет, когда истечет интервал"""
+        self._guild_stats(guild_id)['requested'] += 1
+        self._pending.add(guild_id)
+        task = self._tasks.get(guild_id)
+        if task is None or task.done():
+            self._tasks[guild_id] = asyncio.get_running_loop().create_task(self._run(guild_id))
+
+    def _guild_stats(self, guild_id: int) -> dict:
+        return self._stats.setdefault(guild_id, {'requested': 0, 'refreshed': 0, 'forced': 0})
+
+    def stats(self, guild_id: int) -> dict:
+        """Сколько обновлений запрошено, сделано и схлопнуто (не потребовали своей правки)"""
+        stats = dict(self._guild_stats(guild_id))
+        stats['coalesced'] = max(0, stats['requested'] - stats['refreshed'])
+        return stats
+
+    async def _run(self, guild_id: int):
+        while guild_id in self._pending and not self._closing:
+            delay = self._last_refresh.get(guild_id, float('-inf')) + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._refresh(guild_id)
+
+    async def _refresh(self, guild_id: int, forced: bool = False):
+        lock = self._locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            # Снимаем отметку до правки: изменения во время нее попадут в следующую
+            self._pending.discard(guild_id)
+            self._last_refresh[guild_id] = time.monotonic()
+            stats = self._guild_stats(guild_id)
+            stats['forced' if forced else 'refreshed'] += 1
+            await auto_update_leaderboard(guild_id)
+        logger.debug(
+            f"📊 Лидерборд {guild_id}: запросов {stats['requested']}, правок {stats['refreshed']}, "
+            f"объединено {stats['requested'] - stats['refreshed']}"
+        )
+
+    async def refresh_now(self, guild_id: int):
+        """Обновляет сразу, минуя интервал (/update_leaderboard)"""
+        await self._refresh(guild_id, forced=True)
+
+    async def close(self):
+        """Обновляет отложенные лидерборды при выключении бота"""
+        self._closing = True
+        for guild_id, task in self._tasks.items():
+            if not task.done() and not self._locks.get(guild_id, asyncio.Lock()).locked():
+                task.cancel()
+        running = [task for task in self._tasks.values() if not task.done()]
+        await asyncio.gather(*running, return_exceptions=True)
+        await asyncio.gather(*(self._refresh(guild_id) for guild_id in list(self._pending)), return_exceptions=True)
+
+LEADERBOARDS = LeaderboardRefresher(LEADERBOARD_INTERVAL)
+
+async def distribute_prizes(guild_id: int, registration_order: list):
+    """Распределяет призы за первые три места (порядок регистрации - снимок на момент /end)
+
+    Отметку prizes_distributed ставит вызывающий, под блокировкой сервера.
+    """
+    if len(registration_order) < 3:
         return [], "Недостаточно игроков для распределения призов"
     
-    if config['prizes_distributed']:
-        return [], "Призы уже были распределены ранее"
-    
     prize_results = []
     errors = []
     
     # Распределяем призы для топ-3
     for place in range(1, 4):
-        if len(config['registration_order']) >= place:
-            user_id = config['registration_order'][place - 1]
+        if len(registration_order) >= place:
+            user_id = registration_order[place - 1]
             prize_amount = PRIZES[place]
             
             success, message = await add_money_to_user(guild_id, user_id, prize_amount)
@@ -895,11 +3089,248 @@ async def distribute_prizes(guild_id: int, config: dict):
                 errors.append(f"{place} место ({username}): {message}")
                 logger.error(f"❌ Ошибка выдачи приза {place} место: {message}")
     
-    config['prizes_distributed'] = True
-    await save_data_with_backup(guild_id)
-    
     return prize_results, errors
 
+class RegistrationQueue:
+    """Фоновое применение регистраций: роль и ник выдаются по порядку, с паузами под лимиты Discord
+
+    /reg только фиксирует игрока в состоянии и сразу отвечает. Сохранение, бэкап и
+    обновление лидерборда делаются здесь один раз на пачку, а не на каждого игрока.
+    """
+
+    def __init__(self, batch_size: int, delay: float):
+        self.batch_size = max(1, batch_size)
+        self.delay = delay
+        self._queues = {}
+        self._workers = {}
+        # Серверы, для которых reconcile уже запускался в этом процессе
+        self._reconciled = set()
+
+    def submit(self, interaction: discord.Interaction, player_number: int):
+        """Ставит выдачу роли и ника зарегистрированному игроку в очередь сервера"""
+        guild_id = interaction.guild.id
+        self._queues.setdefault(guild_id, collections.deque()).append((interaction, player_number))
+        worker = self._workers.get(guild_id)
+        if worker is None or worker.done():
+            self._workers[guild_id] = asyncio.get_running_loop().create_task(self._run(guild_id))
+
+    def pending(self, guild_id: int) -> int:
+        """Сколько игроков сервера еще ждут роль и ник"""
+        return len(self._queues.get(guild_id, ()))
+
+    async def close(self, timeout: float = 10.0):
+        """Дает очередям доработать при выключении; что не успело - выдаст reconcile при запуске"""
+        workers = [worker for worker in self._workers.values() if not worker.done()]
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for worker in pending:
+            worker.cancel()
+        left = [interaction.user.id for queue in self._queues.values() for interaction, _ in queue]
+        if left:
+            logger.warning(
+                f"⚠️ Очередь регистраций остановлена, без роли/ника осталось игроков: {len(left)} "
+                f"({', '.join(map(str, left))})"
+            )
+
+    def reconcile(self, guild, config: GuildState):
+        """Запускает выдачу роли и ника игрокам, у которых они не совпадают с состоянием
+
+        Очередь живет только в памяти: регистрации, не примененные до выключения или
+        падения, находятся здесь сравнением состояния с ролями и никами участников.
+        Выполняется один раз на сервер за процесс - on_ready повторяется при переподключениях,
+        а то, что не выдалось (Forbidden), при повторе снова не выдастся.
+        """
+        if guild.id in self._reconciled:
+            return
+        self._reconciled.add(guild.id)
+        
+        role = GUILD_OBJECTS.registration_role(guild, config)
+        me = guild.me
+        # Игроки в живой очереди получат роль и ник оттуда
+        queued = {interaction.user.id for interaction, _ in self._queues.get(guild.id, ())}
+        missing = []
+        for user_id, player_number in config['player_numbers'].items():
+            member = guild.get_member(user_id)
+            if member is None or user_id not in config['registered_players'] or user_id in queued:
+                continue
+            has_nick = member.display_name == add_number_to_nick(member.display_name, format_number(player_number))
+            # Ник владельца сервера и участников с ролью не ниже роли бота изменить нельзя
+            can_rename = member.id != guild.owner_id and (me is None or member.top_role < me.top_role)
+            if role is None or role not in member.roles or (not has_nick and can_rename):
+                missing.append((member, player_number))
+        if not missing:
+            return
+        
+        logger.info(f"🔄 Дозапуск очереди: роль/ник не выданы {len(missing)} игрокам на сервере {guild.name}")
+        self._workers[('reconcile', guild.id)] = asyncio.get_running_loop().create_task(
+            self._reconcile_members(guild, missing)
+        )
+
+    async def _reconcile_members(self, guild, missing: list):
+        counts = await self.apply_import(guild, missing, 1)
+        # Не выданные из-за прав не повторяем - до перезапуска они считаются обработанными
+        if counts['failed']:
+            logger.warning(f"⚠️ Дозапуск очереди: нет прав на выдачу роли {counts['failed']} игрокам на сервере {guild.name}")
+
+    async def _run(self, guild_id: int):
+        queue = self._queues[guild_id]
+        while queue:
+            batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+            try:
+                await self._apply_batch(guild_id, batch)
+            except Exception as e:
+                logger.error(f"❌ Ошибка очереди регистраций для сервера {guild_id}: {e}")
+
+    async def _discord_call(self, action) -> bool:
+        """Выполняет запрос к Discord; при 429 ждет и повторяет. Forbidden пробрасывается"""
+        for attempt in range(3):
+            try:
+                await action()
+                return True
+            except discord.Forbidden:
+                raise
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+        return False
+
+    async def _notify(self, interaction: discord.Interaction, key: str):
+        """Сообщает игроку об ошибке уже после ответа на /reg"""
+        embed = discord.Embed(
+            title=get_localized_text(interaction.guild.id, 'error_permissions'),
+            description=get_localized_text(interaction.guild.id, key),
+            color=0xff0000
+        )
+        try:
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        except discord.HTTPException as e:
+            logger.warning(f"⚠️ Не удалось сообщить игроку об ошибке регистрации: {e}")
+
+    async def _registration_role(self, guild, config: GuildState):
+        """Роль регистрации сервера; создается, если ее нет. Forbidden пробрасывается"""
+        registration_role = GUILD_OBJECTS.registration_role(guild, config)
+        if not registration_role:
+            registration_role = await guild.create_role(
+                name=config['registration_role_name'],
+                color=0xff0000,
+                reason="Роль для зарегистрированных игроков"
+            )
+            GUILD_OBJECTS.remember_role(guild.id, config, registration_role)
+        return registration_role
+
+    async def _apply_member(self, member: discord.Member, registration_role, player_number: int):
+        """Выдает роль и ник с номером; Forbidden на выдаче роли пробрасывается"""
+        try:
+            await self._discord_call(lambda: member.add_roles(registration_role))
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException as e:
+            logger.error(f"❌ Не удалось выдать роль {member.display_name}: {e}")
+        
+        try:
+            new_nickname = add_number_to_nick(member.display_name, format_number(player_number))
+            await self._discord_call(lambda: member.edit(nick=new_nickname))
+        except discord.Forbidden:
+            pass
+        except discord.HTTPException as e:
+            logger.error(f"❌ Не удалось изменить ник {member.display_name}: {e}")
+
+    async def _apply_batch(self, guild_id: int, batch: list):
+        # Игроки уже записаны в состояние - сохраняем и обновляем лидерборд один раз на пачку
+        await save_data_with_backup(guild_id)
+        LEADERBOARDS.request(guild_id)
+        
+        guild = batch[0][0].guild
+        config = get_guild_config(guild_id)
+        try:
+            registration_role = await self._registration_role(guild, config)
+        except discord.Forbidden:
+            for interaction, _ in batch:
+                await self._notify(interaction, 'error_role_creation')
+            return
+        
+        for interaction, player_number in batch:
+            member = cast(discord.Member, interaction.user)
+            # Пока игрок ждал в очереди, его могли сбросить или сменить номер
+            if config['player_numbers'].get(member.id) != player_number:
+                continue
+            
+            try:
+                await self._apply_member(member, registration_role, player_number)
+            except discord.Forbidden:
+                await self._notify(interaction, 'error_role_assignment')
+                continue
+            
+            await asyncio.sleep(self.delay)
+        
+        logger.info(f"✅ Очередь регистраций: обработано {len(batch)} игроков на сервере {config['guild_name']}")
+
+    async def apply_import(self, guild, members: list, concurrency: int, progress=None) -> dict:
+        """Выдает роли и ники импортированным участникам несколькими воркерами с паузами
+
+        members - список (участник, номер); progress(обработано, всего) вызывается
+        не чаще раза в 2 секунды. Возвращает счетчики {'applied', 'skipped', 'failed'}.
+        """
+        config = get_guild_config(guild.id)
+        counts = {'applied': 0, 'skipped': 0, 'failed': 0}
+        try:
+            registration_role = await self._registration_role(guild, config)
+        except discord.Forbidden:
+            counts['failed'] = len(members)
+            return counts
+        
+        pending = collections.deque(members)
+        total = len(members)
+        last_report = time.monotonic()
+        
+        async def worker():
+            nonlocal last_report
+            while pending:
+                member, player_number = pending.popleft()
+                # Пока шел импорт, участника могли сбросить (/reset) или сменить номер
+                if get_guild_config(guild.id)['player_numbers'].get(member.id) != player_number:
+                    counts['skipped'] += 1
+                    continue
+                try:
+                    await self._apply_member(member, registration_role, player_number)
+                    counts['applied'] += 1
+                except discord.Forbidden:
+                    counts['failed'] += 1
+                except Exception as e:
+                    logger.error(f"❌ Ошибка импорта участника {member.id}: {e}")
+                    counts['failed'] += 1
+                
+                if progress is not None and time.monotonic() - last_report >= 2:
+                    last_report = time.monotonic()
+                    await progress(total - len(pending), total)
+                await asyncio.sleep(self.delay)
+        
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+        logger.info(f"✅ Импорт: роли и ники выданы {counts['applied']}/{total} участникам на сервере {config['guild_name']}")
+        return counts
+
+REGISTRATIONS = RegistrationQueue(REG_BATCH_SIZE, REG_APPLY_DELAY)
+
+# Время от начала /reg до первого ответа Discord (defer или сразу номер) и был ли defer -
+# последние 500 успешных регистраций, секунды
+REG_ACK_TIMES = collections.deque(maxlen=500)
+
+def reg_ack_summary() -> str:
+    """p50/p95 времени первого ответа /reg для /ping"""
+    if not REG_ACK_TIMES:
+        return "нет данных"
+    samples = sorted(seconds for seconds, _ in REG_ACK_TIMES)
+    p50 = samples[len(samples) // 2] * 1000
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+    if REG_FAST_ACK:
+        deferred = sum(1 for _, was_deferred in REG_ACK_TIMES if was_deferred)
+        mode = f"быстрый, defer {deferred * 100 // len(REG_ACK_TIMES)}%"
+    else:
+        mode = "defer"
+    return f"p50 {p50:.0f}мс / p95 {p95:.0f}мс ({len(samples)}, {mode})"
+
 # ==================== НОВАЯ КОМАНДА LANGUAGE ====================
 
 @bot.tree.command(name="language", description="Set bot language for this server (Admins)")
@@ -1074,40 +3505,51 @@ async def server_info(interaction: discord.Interaction):
             return
         
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        last_backup = BACKUPS.last_backup_time(interaction.guild.id)
         
-        embed = discord.Embed(
-            title=get_localized_text(interaction.guild.id, 'server_info_title'),
-            description=get_localized_text(interaction.guild.id, 'server_info_description', guild_name=interaction.guild.name),
-            color=0xff0000
-        )
-        
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'server_info_limits'),
-            value=(
-                f"• {get_localized_text(interaction.guild.id, 'server_info_max_players')}: `{config['max_players']}`\n"
-                f"• {get_localized_text(interaction.guild.id, 'server_info_number_range')}: `{config['min_number']:03d}-{config['max_number']:03d}`\n"
-                f"• {get_localized_text(interaction.guild.id, 'server_info_participation_reward')}: `{config['reward_amount']:,}$`"
-            ),
-            inline=False
-        )
-        
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'server_info_status'),
-            value=(
-                f"• {get_localized_text(interaction.guild.id, 'server_info_registration')}: `{'🟢 ' + get_localized_text(interaction.guild.id, 'status_reg_open') if config['registration_open'] else '🔴 ' + get_localized_text(interaction.guild.id, 'status_reg_closed')}`\n"
-                f"• {get_localized_text(interaction.guild.id, 'server_info_game')}: `{'🟢 ' + get_localized_text(interaction.guild.id, 'status_game_active') if config['game_active'] else '🔴 ' + get_localized_text(interaction.guild.id, 'status_game_ended')}`\n"
-                f"• {get_localized_text(interaction.guild.id, 'server_info_prizes_distributed')}: `{'✅ ДА' if config['prizes_distributed'] else '❌ НЕТ'}`"
-            ),
-            inline=False
-        )
+        def build_embed():
+            embed = discord.Embed(
+                title=get_localized_text(interaction.guild.id, 'server_info_title'),
+                description=get_localized_text(interaction.guild.id, 'server_info_description', guild_name=interaction.guild.name),
+                color=0xff0000
+            )
+            
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'server_info_limits'),
+                value=(
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_max_players')}: `{config['max_players']}`\n"
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_number_range')}: `{config['min_number']:03d}-{config['max_number']:03d}`\n"
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_participation_reward')}: `{config['reward_amount']:,}$`"
+                ),
+                inline=False
+            )
+            
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'server_info_status'),
+                value=(
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_registration')}: `{'🟢 ' + get_localized_text(interaction.guild.id, 'status_reg_open') if config['registration_open'] else '🔴 ' + get_localized_text(interaction.guild.id, 'status_reg_closed')}`\n"
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_game')}: `{'🟢 ' + get_localized_text(interaction.guild.id, 'status_game_active') if config['game_active'] else '🔴 ' + get_localized_text(interaction.guild.id, 'status_game_ended')}`\n"
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_prizes_distributed')}: `{'✅ ДА' if config['prizes_distributed'] else '❌ НЕТ'}`"
+                ),
+                inline=False
+            )
+            
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'server_info_statistics'),
+                value=(
+                    f"• {get_localized_text(interaction.guild.id, 'players_registered')}: `{len(config['registered_players'])}/{config['max_players']}`\n"
+                    f"• Использовано номеров: `{len(config['used_numbers'])}`\n"
+                    f"• {get_localized_text(interaction.guild.id, 'server_info_titles_given')}: `{len(config['player_titles'])}`"
+                ),
+                inline=False
+            )
+            return embed
         
+        # Общая часть кэшируется; время бэкапа и админский блок добавляются к копии
+        embed = (await RENDERS.render(interaction.guild.id, 'server_info', 1, config, build_embed)).copy()
         embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'server_info_statistics'),
-            value=(
-                f"• {get_localized_text(interaction.guild.id, 'players_registered')}: `{len(config['registered_players'])}/{config['max_players']}`\n"
-                f"• Использовано номеров: `{len(config['used_numbers'])}`\n"
-                f"• {get_localized_text(interaction.guild.id, 'server_info_titles_given')}: `{len(config['player_titles'])}`"
-            ),
+            name="💾 Последний бэкап",
+            value=f"`{last_backup.strftime('%Y-%m-%d %H:%M:%S') if last_backup else '—'}`",
             inline=False
         )
         
@@ -1184,114 +3626,80 @@ async def start(interaction: discord.Interaction):
 @bot.tree.command(name="reg", description="Register for the game")
 async def reg(interaction: discord.Interaction):
     """Команда для регистрации игрока"""
+    started = time.perf_counter()
+    acked = None
     try:
-        await safe_defer_response(interaction, ephemeral=True)
-        
         if not interaction.guild:
-            await safe_edit_response(interaction, content=get_localized_text(0, 'error_guild_only'))
+            await safe_reply(interaction, content=get_localized_text(0, 'error_guild_only'))
             return
         
-        config = get_guild_config(interaction.guild.id, interaction.guild.name)
-        
-        # Убедимся, что used_numbers и registered_players являются множествами
-        if not isinstance(config['used_numbers'], set):
-            config['used_numbers'] = set(config['used_numbers'])
-        if not isinstance(config['registered_players'], set):
-            config['registered_players'] = set(config['registered_players'])
+        # Проверка мест и выдача номера - под блокировкой сервера, чтобы одновременные /reg
+        # не превысили max_players и не пересеклись с /end, /reset и другими изменениями
+        # (конфиг берем под блокировкой - /restore мог заменить его целиком)
+        async def defer():
+            nonlocal acked
+            await safe_defer_response(interaction, ephemeral=True)
+            acked = time.perf_counter()
+        
+        lock = guild_lock(interaction.guild.id)
+        if not REG_FAST_ACK:
+            await defer()
+            await lock.acquire()
+        else:
+            # В быстром режиме отвечаем сразу готовым номером; defer - только если блокировку
+            # держит долгая команда (например, /restore) и ответ может не уложиться в 3 секунды
+            await acquire_or_defer(lock, defer, REG_ACK_LOCK_WAIT)
+        try:
+            config = get_guild_config(interaction.guild.id, interaction.guild.name)
+            status, player_number = admit_player(config, interaction.user.id)
+        finally:
+            lock.release()
         
-        if not config['registration_open']:
+        if status == 'closed':
             embed = discord.Embed(
                 title=get_localized_text(interaction.guild.id, 'error_reg_closed'),
                 description=get_localized_text(interaction.guild.id, 'error_wait_for_open'),
                 color=0xff0000
             )
             embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
+            await safe_reply(interaction, embed=embed)
             return
         
-        if len(config['registered_players']) >= config['max_players']:
+        if status == 'full':
             embed = discord.Embed(
                 title=get_localized_text(interaction.guild.id, 'error_all_spots_taken'),
                 description=get_localized_text(interaction.guild.id, 'error_registration_completed', max_players=config['max_players']),
                 color=0xff0000
             )
             embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
+            await safe_reply(interaction, embed=embed)
             return
         
-        if interaction.user.id in config['registered_players']:
+        if status == 'registered':
             embed = discord.Embed(
                 title=get_localized_text(interaction.guild.id, 'error_already_registered'),
                 description=get_localized_text(interaction.guild.id, 'error_already_participating'),
                 color=0xff0000
             )
             embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
+            await safe_reply(interaction, embed=embed)
             return
         
-        if len(config['used_numbers']) >= (config['max_number'] - config['min_number'] + 1):
+        if status == 'no_numbers':
             embed = discord.Embed(
                 title=get_localized_text(interaction.guild.id, 'error_system'),
                 description=get_localized_text(interaction.guild.id, 'error_all_numbers_taken'),
                 color=0xff0000
             )
             embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
+            await safe_reply(interaction, embed=embed)
             return
         
-        while True:
-            player_number = random.randint(config['min_number'], config['max_number'])
-            if player_number not in config['used_numbers']:
-                config['used_numbers'].add(player_number)
-                break
-        
-        formatted_number = f"{player_number:03d}"
-        
-        config['registered_players'].add(interaction.user.id)
-        config['player_numbers'][interaction.user.id] = formatted_number
-        if interaction.user.id not in config['registration_order']:
-            config['registration_order'].append(interaction.user.id)
-        
-        await save_data_with_backup(interaction.guild.id)
-        
-        # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА ПРИ РЕГИСТРАЦИИ
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
-        
-        registration_role = discord.utils.get(interaction.guild.roles, name=config['registration_role_name'])
-        
-        if not registration_role:
-            try:
-                registration_role = await interaction.guild.create_role(
-                    name=config['registration_role_name'],
-                    color=0xff0000,
-                    reason="Роль для зарегистрированных игроков"
-                )
-            except discord.Forbidden:
-                embed = discord.Embed(
-                    title=get_localized_text(interaction.guild.id, 'error_permissions'),
-                    description=get_localized_text(interaction.guild.id, 'error_role_creation'),
-                    color=0xff0000
-                )
-                await safe_edit_response(interaction, embed=embed)
-                return
-        
-        member = cast(discord.Member, interaction.user)
-        try:
-            await member.add_roles(registration_role)
-        except discord.Forbidden:
-            embed = discord.Embed(
-                title=get_localized_text(interaction.guild.id, 'error_permissions'),
-                description=get_localized_text(interaction.guild.id, 'error_role_assignment'),
-                color=0xff0000
-            )
-            await safe_edit_response(interaction, embed=embed)
-            return
+        formatted_number = format_number(player_number)
         
-        try:
-            new_nickname = add_number_to_nick(member.display_name, formatted_number)
-            await member.edit(nick=new_nickname)
-        except discord.Forbidden:
-            pass
+        # Роль, ник, сохранение и лидерборд - в фоновой очереди; игроку отвечаем сразу
+        REGISTRATIONS.submit(interaction, player_number)
+        PLAYER_SEARCH.add(interaction.guild, interaction.user.id, player_number)
         
         embed = discord.Embed(
             title=get_localized_text(interaction.guild.id, 'reg_success'),
@@ -1321,7 +3729,8 @@ async def reg(interaction: discord.Interaction):
         embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
         embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
         
-        await safe_edit_response(interaction, embed=embed)
+        await safe_reply(interaction, embed=embed)
+        REG_ACK_TIMES.append(((acked or time.perf_counter()) - started, acked is not None))
         
     except Exception as e:
         logger.error(f"❌ Ошибка в команде reg: {e}")
@@ -1340,63 +3749,68 @@ async def status(interaction: discord.Interaction):
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
         available_spots = config['max_players'] - len(config['registered_players'])
         
-        embed = discord.Embed(
-            title=get_localized_text(interaction.guild.id, 'status_title'),
-            color=0xff0000
-        )
-        
-        # Статус регистрации
-        if config['registration_open']:
-            reg_status = get_localized_text(interaction.guild.id, 'status_reg_open')
-            reg_description = get_localized_text(interaction.guild.id, 'status_reg_active')
-        else:
-            reg_status = get_localized_text(interaction.guild.id, 'status_reg_closed')
-            reg_description = get_localized_text(interaction.guild.id, 'status_reg_inactive')
-        
-        # Статус игры
-        if config['game_active']:
-            game_status = get_localized_text(interaction.guild.id, 'status_game_active')
-            game_description = get_localized_text(interaction.guild.id, 'status_game_in_progress')
-        else:
-            game_status = get_localized_text(interaction.guild.id, 'status_game_ended')
-            game_description = get_localized_text(interaction.guild.id, 'status_game_completed')
-        
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'status_registration'),
-            value=f"```{reg_status}```\n{reg_description}",
-            inline=True
-        )
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'status_game'),
-            value=f"```{game_status}```\n{game_description}",
-            inline=True
-        )
-        
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'status_registered'),
-            value=f"```{len(config['registered_players'])}/{config['max_players']} {get_localized_text(interaction.guild.id, 'status_players')}```",
-            inline=True
-        )
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'status_available_spots'),
-            value=f"```{available_spots} {get_localized_text(interaction.guild.id, 'status_spots')}```",
-            inline=True
-        )
-        embed.add_field(
-            name=get_localized_text(interaction.guild.id, 'status_used_numbers'),
-            value=f"```{len(config['used_numbers'])} из {config['max_number'] - config['min_number'] + 1}```",
-            inline=True
-        )
-        
-        if config['registration_open'] and available_spots > 0:
+        def build_embed():
+            embed = discord.Embed(
+                title=get_localized_text(interaction.guild.id, 'status_title'),
+                color=0xff0000
+            )
+            
+            # Статус регистрации
+            if config['registration_open']:
+                reg_status = get_localized_text(interaction.guild.id, 'status_reg_open')
+                reg_description = get_localized_text(interaction.guild.id, 'status_reg_active')
+            else:
+                reg_status = get_localized_text(interaction.guild.id, 'status_reg_closed')
+                reg_description = get_localized_text(interaction.guild.id, 'status_reg_inactive')
+            
+            # Статус игры
+            if config['game_active']:
+                game_status = get_localized_text(interaction.guild.id, 'status_game_active')
+                game_description = get_localized_text(interaction.guild.id, 'status_game_in_progress')
+            else:
+                game_status = get_localized_text(interaction.guild.id, 'status_game_ended')
+                game_description = get_localized_text(interaction.guild.id, 'status_game_completed')
+            
             embed.add_field(
-                name=get_localized_text(interaction.guild.id, 'status_join'),
-                value=get_localized_text(interaction.guild.id, 'status_join_info'),
-                inline=False
+                name=get_localized_text(interaction.guild.id, 'status_registration'),
+                value=f"```{reg_status}```\n{reg_description}",
+                inline=True
+            )
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'status_game'),
+                value=f"```{game_status}```\n{game_description}",
+                inline=True
+            )
+            
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'status_registered'),
+                value=f"```{len(config['registered_players'])}/{config['max_players']} {get_localized_text(interaction.guild.id, 'status_players')}```",
+                inline=True
+            )
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'status_available_spots'),
+                value=f"```{available_spots} {get_localized_text(interaction.guild.id, 'status_spots')}```",
+                inline=True
+            )
+            embed.add_field(
+                name=get_localized_text(interaction.guild.id, 'status_used_numbers'),
+                value=f"```{len(config['used_numbers'])} из {config['max_number'] - config['min_number'] + 1}```",
+                inline=True
             )
+            
+            if config['registration_open'] and available_spots > 0:
+                embed.add_field(
+                    name=get_localized_text(interaction.guild.id, 'status_join'),
+                    value=get_localized_text(interaction.guild.id, 'status_join_info'),
+                    inline=False
+                )
+            
+            embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
+            embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
+            return embed
+        
+        embed = await RENDERS.render(interaction.guild.id, 'status', 1, config, build_embed)
         
-        embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
-        embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
         await safe_edit_response(interaction, embed=embed)
         
     except Exception as e:
@@ -1414,46 +3828,48 @@ async def end(interaction: discord.Interaction):
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        config = get_guild_config(interaction.guild.id, interaction.guild.name)
-        
-        if not config['game_active']:
-            embed = discord.Embed(
-                title="🎮 ИГРА УЖЕ ЗАВЕРШЕНА",
-                description="Событие уже было завершено ранее",
-                color=0xff0000
-            )
-            embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
-            return
-        
-        if config['registration_open']:
-            # Первое использование - закрываем регистрацию
-            config['registration_open'] = False
+        async with guild_lock(interaction.guild.id):
+            config = get_guild_config(interaction.guild.id, interaction.guild.name)
             
-            # Сохраняем изменения
-            await save_data_with_backup(interaction.guild.id)
+            if not config['game_active']:
+                embed = discord.Embed(
+                    title="🎮 ИГРА УЖЕ ЗАВЕРШЕНА",
+                    description="Событие уже было завершено ранее",
+                    color=0xff0000
+                )
+                embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
+                await safe_edit_response(interaction, embed=embed)
+                return
             
-            embed = discord.Embed(
-                title="🔒 РЕГИСТРАЦИЯ ЗАКРЫТА",
-                description="Новые игроки не могут присоединиться. Игра продолжается для зарегистрированных участников.",
-                color=0xff0000
-            )
-            embed.add_field(
-                name="📊 Статистика",
-                value=f"```Зарегистрировано игроков: {len(config['registered_players'])}/{config['max_players']}```",
-                inline=False
-            )
-            embed.add_field(
-                name="💡 Следующий шаг",
-                value="Для полного завершения события используйте команду `/end` еще раз",
-                inline=False
-            )
-            embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
-            embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
+            if config['registration_open']:
+                # Первое использование - закрываем регистрацию
+                config['registration_open'] = False
+                
+                # Сохраняем изменения
+                await save_data_with_backup(interaction.guild.id)
+                
+                embed = discord.Embed(
+                    title="🔒 РЕГИСТРАЦИЯ ЗАКРЫТА",
+                    description="Новые игроки не могут присоединиться. Игра продолжается для зарегистрированных участников.",
+                    color=0xff0000
+                )
+                embed.add_field(
+                    name="📊 Статистика",
+                    value=f"```Зарегистрировано игроков: {len(config['registered_players'])}/{config['max_players']}```",
+                    inline=False
+                )
+                embed.add_field(
+                    name="💡 Следующий шаг",
+                    value="Для полного завершения события используйте команду `/end` еще раз",
+                    inline=False
+                )
+                embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
+                embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
+                await safe_edit_response(interaction, embed=embed)
+                return
             
-        else:
-            # Второе использование - завершаем игру полностью
+            # Второе использование - завершаем игру. Под блокировкой только фиксируем итог
+            # и очищаем данные; выплаты, роли и ники идут потом по снимку, не задерживая сервер
             config['game_active'] = False
             
             if not config['registered_players']:
@@ -1466,150 +3882,160 @@ async def end(interaction: discord.Interaction):
                 await safe_edit_response(interaction, embed=embed)
                 return
             
-            registration_role = discord.utils.get(interaction.guild.roles, name=config['registration_role_name'])
-            reset_count = 0
-            money_sent_count = 0
-            money_errors = []
-            role_errors = []
-            nick_errors = []
-            
-            # Начисляем деньги и сбрасываем игроков
-            processing_embed = discord.Embed(
-                title="⏳ ЗАВЕРШЕНИЕ ИГРЫ",
-                description="Идет процесс завершения... Начисление денег и сброс данных",
-                color=0xff0000
-            )
-            processing_embed.add_field(
-                name="📊 Прогресс",
-                value="```Обработка игроков...```",
-                inline=False
-            )
-            await safe_edit_response(interaction, embed=processing_embed)
-            
-            # Распределяем призы для топ-3 игроков (если еще не распределены)
-            prize_results = []
-            prize_errors = []
-            if not config['prizes_distributed'] and len(config['registration_order']) >= 3:
-                prize_results, prize_errors = await distribute_prizes(interaction.guild.id, config)
-            
-            # Обрабатываем каждого игрока
-            for user_id in list(config['registered_players']):
-                try:
-                    member = await interaction.guild.fetch_member(user_id)
-                    
-                    # Начисляем базовые деньги через UnbelievaBoat (используем награду сервера)
-                    success, message = await add_money_to_user(interaction.guild.id, user_id, config['reward_amount'])
-                    if success:
-                        money_sent_count += 1
-                    else:
-                        money_errors.append(f"{member.display_name}: {message}")
-                    
-                    # Пытаемся убрать роль
-                    try:
-                        if registration_role and registration_role in member.roles:
-                            await member.remove_roles(registration_role)
-                    except discord.Forbidden:
-                        role_errors.append(f"{member.display_name}")
-                    
-                    # Пытаемся вернуть ник
-                    try:
-                        original_nickname = remove_number_from_nick(member.display_name)
-                        if not original_nickname or original_nickname.isspace():
-                            original_nickname = member.name
-                        await member.edit(nick=original_nickname)
-                    except discord.Forbidden:
-                        nick_errors.append(f"{member.display_name}")
-                    
-                    reset_count += 1
-                    
-                    # Небольшая задержка чтобы не перегружать API
-                    await asyncio.sleep(0.5)
-                    
-                except (discord.NotFound, discord.Forbidden) as e:
-                    money_errors.append(f"ID {user_id}: {str(e)}")
-                    continue
+            players = list(config['registered_players'])
+            registration_order = list(config['registration_order'])
+            reward_amount = config['reward_amount']
+            total_players = len(players)
+            # Флаг ставится до выплаты - повторный /end или /restore не выплатят призы второй раз
+            pay_prizes = not config['prizes_distributed'] and len(registration_order) >= 3
+            if pay_prizes:
+                config['prizes_distributed'] = True
+            registration_role = GUILD_OBJECTS.registration_role(interaction.guild, config)
             
             # Очищаем все данные (кроме титулов)
-            total_players = len(config['registered_players'])
-            config['used_numbers'].clear()
+            config.clear_numbers()
             config['registered_players'].clear()
             config['player_numbers'].clear()
             config['registration_order'].clear()
+            config.mark_dirty('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
+            PLAYER_SEARCH.invalidate(interaction.guild.id)
             # ТИТУЛЫ НЕ УДАЛЯЕМ - они сохраняются навсегда
             
             # Сохраняем изменения
             await save_data_with_backup(interaction.guild.id)
-            
-            # Финальное сообщение
-            result_embed = discord.Embed(
-                title="🎮 ИГРА ЗАВЕРШЕНА",
-                description="Событие полностью завершено, все данные сброшены",
-                color=0xff0000
+        
+        reset_count = 0
+        money_sent_count = 0
+        money_errors = []
+        role_errors = []
+        nick_errors = []
+        
+        # Начисляем деньги и сбрасываем игроков
+        processing_embed = discord.Embed(
+            title="⏳ ЗАВЕРШЕНИЕ ИГРЫ",
+            description="Идет процесс завершения... Начисление денег и сброс данных",
+            color=0xff0000
+        )
+        processing_embed.add_field(
+            name="📊 Прогресс",
+            value="```Обработка игроков...```",
+            inline=False
+        )
+        await safe_edit_response(interaction, embed=processing_embed)
+        
+        # Распределяем призы для топ-3 игроков (если еще не распределены)
+        prize_results = []
+        prize_errors = []
+        if pay_prizes:
+            prize_results, prize_errors = await distribute_prizes(interaction.guild.id, registration_order)
+        
+        # Обрабатываем каждого игрока
+        for user_id in players:
+            try:
+                member = await interaction.guild.fetch_member(user_id)
+                
+                # Начисляем базовые деньги через UnbelievaBoat (используем награду сервера)
+                success, message = await add_money_to_user(interaction.guild.id, user_id, reward_amount)
+                if success:
+                    money_sent_count += 1
+                else:
+                    money_errors.append(f"{member.display_name}: {message}")
+                
+                # Пытаемся убрать роль
+                try:
+                    if registration_role and registration_role in member.roles:
+                        await member.remove_roles(registration_role)
+                except discord.Forbidden:
+                    role_errors.append(f"{member.display_name}")
+                
+                # Пытаемся вернуть ник
+                try:
+                    original_nickname = remove_number_from_nick(member.display_name)
+                    if not original_nickname or original_nickname.isspace():
+                        original_nickname = member.name
+                    await member.edit(nick=original_nickname)
+                except discord.Forbidden:
+                    nick_errors.append(f"{member.display_name}")
+                
+                reset_count += 1
+                
+                # Небольшая задержка чтобы не перегружать API
+                await asyncio.sleep(0.5)
+                
+            except (discord.NotFound, discord.Forbidden) as e:
+                money_errors.append(f"ID {user_id}: {str(e)}")
+                continue
+        
+        # Финальное сообщение
+        result_embed = discord.Embed(
+            title="🎮 ИГРА ЗАВЕРШЕНА",
+            description="Событие полностью завершено, все данные сброшены",
+            color=0xff0000
+        )
+        result_embed.add_field(
+            name="📊 Результаты завершения",
+            value=f"```Успешно сброшено: {reset_count}/{total_players} игроков\nДеньги начислены: {money_sent_count}/{total_players}```",
+            inline=False
+        )
+        result_embed.add_field(
+            name="💰 Награды",
+            value=f"Каждый участник получил **{reward_amount:,}$**",
+            inline=False
+        )
+        
+        # Добавляем информацию о призах если они были распределены
+        if prize_results:
+            result_embed.add_field(
+                name="🏆 Призы за первые три места",
+                value="\n".join(prize_results),
+                inline=False
             )
+        
+        result_embed.add_field(
+            name="🔄 Выполненные действия",
+            value="• Регистрация закрыта\n• Игра завершена\n• Роли удалены\n• Ники восстановлены\n• Данные очищены\n• Деньги начислены\n• 🏆 Титулы сохранены",
+            inline=False
+        )
+        
+        # Показываем ошибки если есть
+        if role_errors:
             result_embed.add_field(
-                name="📊 Результаты завершения",
-                value=f"```Успешно сброшено: {reset_count}/{total_players} игроков\nДеньги начислены: {money_sent_count}/{total_players}```",
+                name="⚠️ Ошибки удаления ролей",
+                value=f"Не удалось убрать роль у {len(role_errors)} игроков",
                 inline=False
             )
+        
+        if nick_errors:
             result_embed.add_field(
-                name="💰 Награды",
-                value=f"Каждый участник получил **{config['reward_amount']:,}$**",
+                name="⚠️ Ошибки восстановления ников",
+                value=f"Не удалось восстановить ники у {len(nick_errors)} игроков",
                 inline=False
             )
-            
-            # Добавляем информацию о призах если они были распределены
-            if prize_results:
-                result_embed.add_field(
-                    name="🏆 Призы за первые три места",
-                    value="\n".join(prize_results),
-                    inline=False
-                )
-            
+        
+        if money_errors:
+            error_text = "\n".join(money_errors[:3])
+            if len(money_errors) > 3:
+                error_text += f"\n... и еще {len(money_errors) - 3} ошибок"
             result_embed.add_field(
-                name="🔄 Выполненные действия",
-                value="• Регистрация закрыта\n• Игра завершена\n• Роли удалены\n• Ники восстановлены\n• Данные очищены\n• Деньги начислены\n• 🏆 Титулы сохранены",
+                name="⚠️ Ошибки начисления денег",
+                value=f"```{error_text}```",
                 inline=False
             )
-            
-            # Показываем ошибки если есть
-            if role_errors:
-                result_embed.add_field(
-                    name="⚠️ Ошибки удаления ролей",
-                    value=f"Не удалось убрать роль у {len(role_errors)} игроков",
-                    inline=False
-                )
-            
-            if nick_errors:
-                result_embed.add_field(
-                    name="⚠️ Ошибки восстановления ников",
-                    value=f"Не удалось восстановить ники у {len(nick_errors)} игроков",
-                    inline=False
-                )
-            
-            if money_errors:
-                error_text = "\n".join(money_errors[:3])
-                if len(money_errors) > 3:
-                    error_text += f"\n... и еще {len(money_errors) - 3} ошибок"
-                result_embed.add_field(
-                    name="⚠️ Ошибки начисления денег",
-                    value=f"```{error_text}```",
-                    inline=False
-                )
-            
-            if prize_errors:
-                error_text = "\n".join(prize_errors[:3])
-                if len(prize_errors) > 3:
-                    error_text += f"\n... и еще {len(prize_errors) - 3} ошибок"
-                result_embed.add_field(
-                    name="⚠️ Ошибки распределения призов",
-                    value=f"```{error_text}```",
-                    inline=False
-                )
-            
-            result_embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
-            result_embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            
-            await safe_edit_response(interaction, embed=result_embed)
+        
+        if prize_errors:
+            error_text = "\n".join(prize_errors[:3])
+            if len(prize_errors) > 3:
+                error_text += f"\n... и еще {len(prize_errors) - 3} ошибок"
+            result_embed.add_field(
+                name="⚠️ Ошибки распределения призов",
+                value=f"```{error_text}```",
+                inline=False
+            )
+        
+        result_embed.set_footer(text=f"Система регистрации • {interaction.guild.name}")
+        result_embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
+        
+        await safe_edit_response(interaction, embed=result_embed)
             
     except Exception as e:
         logger.error(f"❌ Ошибка в команде end: {e}")
@@ -1702,10 +4128,11 @@ async def equip(interaction: discord.Interaction, название_титула:
             return
         
         user_titles['equipped'] = название_титула
+        config.mark_dirty('player_titles')
         await save_data_with_backup(interaction.guild.id)
         
         # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
+        LEADERBOARDS.request(interaction.guild.id)
         
         embed = discord.Embed(
             title="👑 ТИТУЛ НАДЕТ",
@@ -1815,10 +4242,11 @@ async def unequip(interaction: discord.Interaction):
         
         old_title = config['player_titles'][user_id]['equipped']
         config['player_titles'][user_id]['equipped'] = None
+        config.mark_dirty('player_titles')
         await save_data_with_backup(interaction.guild.id)
         
         # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
+        LEADERBOARDS.request(interaction.guild.id)
         
         embed = discord.Embed(
             title="❌ ТИТУЛ СНЯТ",
@@ -1844,80 +4272,95 @@ async def buy(interaction: discord.Interaction, название_титула: s
     try:
         await safe_defer_response(interaction, ephemeral=False)
         
-        if not interaction.guild:
-            await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
-            return
-        
-        config = get_guild_config(interaction.guild.id, interaction.guild.name)
-        
-        if название_титула not in AVAILABLE_TITLES:
-            embed = discord.Embed(
-                title="❌ Ошибка",
-                description="Такого титула не существует. Используйте `/titles` для просмотра доступных титулов.",
-                color=0xff0000
-            )
-            await safe_edit_response(interaction, embed=embed)
-            return
-        
-        user_id = interaction.user.id
-        if user_id not in config['player_titles']:
-            config['player_titles'][user_id] = {'owned': [], 'equipped': None}
-        
-        user_titles = config['player_titles'][user_id]
-        
-        if название_титула in user_titles['owned']:
-            embed = discord.Embed(
-                title="❌ Ошибка",
-                description="У вас уже есть этот титул!",
-                color=0xff0000
-            )
-            await safe_edit_response(interaction, embed=embed)
+        if not interaction.guild:
+            await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        price = TITLE_PRICES[название_титула]
-        
-        success, balance_data = await get_user_balance(interaction.guild.id, user_id)
-        
-        if not success:
+        if название_титула not in AVAILABLE_TITLES:
             embed = discord.Embed(
                 title="❌ Ошибка",
-                description=f"Не удалось проверить баланс: {balance_data}",
+                description="Такого титула не существует. Используйте `/titles` для просмотра доступных титулов.",
                 color=0xff0000
             )
             await safe_edit_response(interaction, embed=embed)
             return
         
-        total_balance = balance_data.get('cash', 0) + balance_data.get('bank', 0)
-        
-        if total_balance < price:
-            embed = discord.Embed(
-                title="❌ Недостаточно средств",
-                description=f"У вас {total_balance:,}$, а нужно {price:,}$",
-                color=0xff0000
-            )
-            await safe_edit_response(interaction, embed=embed)
-            return
+        user_id = interaction.user.id
+        already_owned_embed = discord.Embed(
+            title="❌ Ошибка",
+            description="У вас уже есть этот титул!",
+            color=0xff0000
+        )
         
-        if price > 0:
-            success, message = await add_money_to_user(interaction.guild.id, user_id, -price)
+        # Проверка баланса и списание идут к UnbelievaBoat без блокировки сервера - под ней только
+        # выдача титула; двойное списание у одного игрока исключает его собственная блокировка
+        async with purchase_lock(interaction.guild.id, user_id):
+            config = get_guild_config(interaction.guild.id, interaction.guild.name)
+            if название_титула in config['player_titles'].get(user_id, {}).get('owned', ()):
+                await safe_edit_response(interaction, embed=already_owned_embed)
+                return
+            
+            price = TITLE_PRICES[название_титула]
+            
+            success, balance_data = await get_user_balance(interaction.guild.id, user_id)
+            
             if not success:
                 embed = discord.Embed(
-                    title="❌ Ошибка оплаты",
-                    description=f"Не удалось списать средства: {message}",
+                    title="❌ Ошибка",
+                    description=f"Не удалось проверить баланс: {balance_data}",
                     color=0xff0000
                 )
                 await safe_edit_response(interaction, embed=embed)
                 return
-        
-        user_titles['owned'].append(название_титула)
-        
-        if user_titles['equipped'] is None:
-            user_titles['equipped'] = название_титула
+            
+            total_balance = balance_data.get('cash', 0) + balance_data.get('bank', 0)
+            
+            if total_balance < price:
+                embed = discord.Embed(
+                    title="❌ Недостаточно средств",
+                    description=f"У вас {total_balance:,}$, а нужно {price:,}$",
+                    color=0xff0000
+                )
+                await safe_edit_response(interaction, embed=embed)
+                return
+            
+            if price > 0:
+                success, message = await add_money_to_user(interaction.guild.id, user_id, -price)
+                if not success:
+                    embed = discord.Embed(
+                        title="❌ Ошибка оплаты",
+                        description=f"Не удалось списать средства: {message}",
+                        color=0xff0000
+                    )
+                    await safe_edit_response(interaction, embed=embed)
+                    return
+            
+            # Конфиг берем под блокировкой - пока шла оплата, /restore мог заменить его целиком
+            async with guild_lock(interaction.guild.id):
+                config = get_guild_config(interaction.guild.id, interaction.guild.name)
+                if user_id not in config['player_titles']:
+                    config['player_titles'][user_id] = {'owned': [], 'equipped': None}
+                user_titles = config['player_titles'][user_id]
+                granted = название_титула not in user_titles['owned']
+                if granted:
+                    user_titles['owned'].append(название_титула)
+                    if user_titles['equipped'] is None:
+                        user_titles['equipped'] = название_титула
+                    config.mark_dirty('player_titles')
+            
+            if not granted:
+                # Титул успели выдать другим путем (например, /restore) - возвращаем деньги
+                if price > 0:
+                    refunded, message = await add_money_to_user(interaction.guild.id, user_id, price)
+                    if not refunded:
+                        logger.error(f"❌ Не удалось вернуть {price}$ игроку {user_id}: {message}")
+                await safe_edit_response(interaction, embed=already_owned_embed)
+                return
         
         await save_data_with_backup(interaction.guild.id)
         
         # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
+        LEADERBOARDS.request(interaction.guild.id)
         
         embed = discord.Embed(
             title="✅ ТИТУЛ ПРИОБРЕТЕН",
@@ -1969,8 +4412,11 @@ async def leaderboard(interaction: discord.Interaction, страница: int =
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        embed = await create_leaderboard_embed(interaction.guild.id, страница)
-        await safe_edit_response(interaction, embed=embed)
+        config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        total_pages = leaderboard_total_pages(config)
+        page = страница if 1 <= страница <= total_pages else 1
+        embed = await create_leaderboard_embed(interaction.guild.id, page)
+        await safe_edit_response(interaction, embed=embed, view=LeaderboardView.for_page(page, total_pages))
         
     except Exception as e:
         logger.error(f"❌ Ошибка в команде leaderboard: {e}")
@@ -2007,10 +4453,11 @@ async def cc(interaction: discord.Interaction, игрок: discord.Member):
             user_titles['owned'].append("Контент Креэйтор")
         
         user_titles['equipped'] = "Контент Креэйтор"
+        config.mark_dirty('player_titles')
         await save_data_with_backup(interaction.guild.id)
         
         # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
+        LEADERBOARDS.request(interaction.guild.id)
         
         embed = discord.Embed(
             title="🎁 ТИТУЛ ВЫДАН",
@@ -2046,7 +4493,7 @@ async def set_leaderboard(interaction: discord.Interaction):
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
         
         embed = await create_leaderboard_embed(interaction.guild.id)
-        message = await interaction.channel.send(embed=embed)
+        message = await interaction.channel.send(embed=embed, view=LeaderboardView.for_page(1, leaderboard_total_pages(config)))
         
         config['leaderboard_message_id'] = message.id
         config['leaderboard_channel_id'] = interaction.channel.id
@@ -2081,13 +4528,24 @@ async def update_leaderboard_cmd(interaction: discord.Interaction):
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        await update_leaderboard(interaction.guild.id)
+        await LEADERBOARDS.refresh_now(interaction.guild.id)
+        stats = LEADERBOARDS.stats(interaction.guild.id)
         
         embed = discord.Embed(
             title="✅ ЛИДЕРБОРД ОБНОВЛЕН",
             description="Лидерборд успешно обновлен!",
             color=0x00ff00
         )
+        embed.add_field(
+            name="📊 Автообновления",
+            value=f"```Запросов: {stats['requested']}\nПравок: {stats['refreshed']}\nОбъединено: {stats['coalesced']}```",
+            inline=False
+        )
+        embed.add_field(
+            name="✏️ Правки сообщений (все серверы)",
+            value=f"```Сделано: {LEADERBOARD_EDIT_STATS['performed']}\nПропущено без изменений: {LEADERBOARD_EDIT_STATS['avoided']}```",
+            inline=False
+        )
         
         await safe_edit_response(interaction, embed=embed)
         
@@ -2183,6 +4641,9 @@ async def help_cmd(interaction: discord.Interaction):
                     "`/reset` - Сбросить игрока\n"
                     "`/broadcast` - Рассылка\n"
                     "`/changenumber` - Изменить номер\n"
+                    "`/whois` - Кто под номером\n"
+                    "`/find` - Найти игрока\n"
+                    "`/import_players` - Импорт участников из файла\n"
                     "`/freenumbers` - Свободные номера\n"
                     "`/save` - Сохранить данные\n"
                     "`/load` - Загрузить данные\n"
@@ -2226,6 +4687,16 @@ async def ping(interaction: discord.Interaction):
             value="```Онлайн```",
             inline=True
         )
+        embed.add_field(
+            name="⏱️ Ответ /reg",
+            value=f"```{reg_ack_summary()}```",
+            inline=False
+        )
+        embed.add_field(
+            name="✏️ Правки лидербордов",
+            value=f"```Сделано {LEADERBOARD_EDIT_STATS['performed']}, пропущено {LEADERBOARD_EDIT_STATS['avoided']}```",
+            inline=False
+        )
         
         await safe_edit_response(interaction, embed=embed)
         
@@ -2246,14 +4717,14 @@ async def freenumbers(interaction: discord.Interaction):
         
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
         
-        all_numbers = set(range(config['min_number'], config['max_number'] + 1))
-        free_numbers = all_numbers - config['used_numbers']
+        # Считаем по битовой карте, не перебирая весь диапазон
+        free_count = config['used_numbers'].free_count(config['min_number'], config['max_number'])
         
-        if not free_numbers:
+        if not free_count:
             await safe_edit_response(interaction, content="❌ Свободных номеров нет")
             return
         
-        free_numbers_list = sorted(list(free_numbers))
+        free_numbers_list = config['used_numbers'].next_free(config['min_number'], config['max_number'], 20)
         
         embed = discord.Embed(
             title="🎫 СВОБОДНЫЕ НОМЕРА",
@@ -2261,17 +4732,17 @@ async def freenumbers(interaction: discord.Interaction):
         )
         
         # Показываем первые 20 свободных номеров
-        display_numbers = [f"{num:03d}" for num in free_numbers_list[:20]]
+        display_numbers = [f"{num:03d}" for num in free_numbers_list]
         embed.add_field(
-            name=f"Доступно: {len(free_numbers)}",
+            name=f"Доступно: {free_count}",
             value=", ".join(display_numbers),
             inline=False
         )
         
-        if len(free_numbers) > 20:
+        if free_count > 20:
             embed.add_field(
                 name="ℹ️ Показаны первые 20",
-                value=f"Всего свободно: {len(free_numbers)} номеров",
+                value=f"Всего свободно: {free_count} номеров",
                 inline=False
             )
         
@@ -2281,39 +4752,133 @@ async def freenumbers(interaction: discord.Interaction):
         logger.error(f"❌ Ошибка в команде freenumbers: {e}")
         await safe_send_response(interaction, "❌ Произошла ошибка при показе свободных номеров", ephemeral=True)
 
-@bot.tree.command(name="changenumber", description="Изменить номер игрока (админы)")
+def player_card_embed(guild, config: GuildState, user_id: int) -> discord.Embed:
+    """Карточка игрока для /whois и /find"""
+    embed = discord.Embed(
+        title=f"🔎 НОМЕР {format_number(config['player_numbers'].get(user_id))}",
+        description=f"Игрок: <@{user_id}>",
+        color=0xff0000
+    )
+    member = guild.get_member(user_id)
+    if member:
+        embed.add_field(name="👤 Ник", value=f"```{member.display_name}```", inline=True)
+    embed.add_field(name="🆔 ID", value=f"```{user_id}```", inline=True)
+    if user_id in config['registration_order']:
+        embed.add_field(
+            name="📋 Место в регистрации",
+            value=f"```{config['registration_order'].index(user_id) + 1}```",
+            inline=True
+        )
+    title = config['player_titles'].get(user_id, {}).get('equipped')
+    if title:
+        embed.add_field(name="🏷️ Титул", value=f"```{title}```", inline=True)
+    if member and member.display_avatar:
+        embed.set_thumbnail(url=member.display_avatar.url)
+    return embed
+
+@bot.tree.command(name="whois", description="Кто играет под номером (админы)")
 @app_commands.default_permissions(administrator=True)
-async def changenumber(interaction: discord.Interaction, игрок: discord.Member, новый_номер: int):
-    """Изменяет номер игрока"""
+@app_commands.describe(номер="Игровой номер, например 42 или 042")
+async def whois(interaction: discord.Interaction, номер: int):
+    """Находит игрока по номеру через обратный индекс номеров"""
     try:
-        await safe_defer_response(interaction, ephemeral=True)
-        
         if not interaction.guild:
-            await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
+            await safe_send_response(interaction, "❌ Эта команда работает только на сервере", ephemeral=True)
             return
         
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        user_id = config['player_numbers'].owner(номер)
+        if user_id is None:
+            await safe_send_response(interaction, f"❌ Номер {format_number(номер)} никому не выдан", ephemeral=True)
+            return
         
-        if игрок.id not in config['registered_players']:
-            await safe_edit_response(interaction, content="❌ Игрок не зарегистрирован")
+        await safe_send_response(interaction, embed=player_card_embed(interaction.guild, config, user_id), ephemeral=True)
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка в команде whois: {e}")
+        await safe_send_response(interaction, "❌ Произошла ошибка при поиске игрока", ephemeral=True)
+
+async def find_player_autocomplete(interaction: discord.Interaction, current: str) -> list:
+    """Подсказки /find: до 25 игроков по префиксу ника или номера"""
+    if not interaction.guild:
+        return []
+    config = get_guild_config(interaction.guild.id, interaction.guild.name)
+    if current.strip():
+        user_ids = PLAYER_SEARCH.search(interaction.guild, current)
+    else:
+        user_ids = config['registration_order'][:25]
+    return [
+        app_commands.Choice(
+            name=f"{format_number(config['player_numbers'].get(user_id))} · {PlayerSearch.player_name(interaction.guild, user_id)}"[:100],
+            value=str(user_id)
+        )
+        for user_id in user_ids
+    ]
+
+@bot.tree.command(name="find", description="Найти игрока по нику или номеру (админы)")
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(игрок="Начало ника или номера")
+@app_commands.autocomplete(игрок=find_player_autocomplete)
+async def find(interaction: discord.Interaction, игрок: str):
+    """Показывает карточку игрока; значение приходит из подсказки (ID) или вводится вручную"""
+    try:
+        if not interaction.guild:
+            await safe_send_response(interaction, "❌ Эта команда работает только на сервере", ephemeral=True)
             return
         
-        if новый_номер < config['min_number'] or новый_номер > config['max_number']:
-            await safe_edit_response(interaction, content=f"❌ Номер должен быть от {config['min_number']} до {config['max_number']}")
+        config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        user_id = int(игрок) if игрок.isdigit() and int(игрок) in config['registered_players'] else None
+        if user_id is None:
+            matches = PLAYER_SEARCH.search(interaction.guild, игрок, 1)
+            user_id = matches[0] if matches else None
+        if user_id is None:
+            await safe_send_response(interaction, f"❌ Игрок «{игрок[:50]}» не найден", ephemeral=True)
             return
         
-        formatted_number = f"{новый_номер:03d}"
+        await safe_send_response(interaction, embed=player_card_embed(interaction.guild, config, user_id), ephemeral=True)
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка в команде find: {e}")
+        await safe_send_response(interaction, "❌ Произошла ошибка при поиске игрока", ephemeral=True)
+
+@bot.tree.command(name="changenumber", description="Изменить номер игрока (админы)")
+@app_commands.default_permissions(administrator=True)
+async def changenumber(interaction: discord.Interaction, игрок: discord.Member, новый_номер: int):
+    """Изменяет номер игрока"""
+    try:
+        await safe_defer_response(interaction, ephemeral=True)
         
-        # Удаляем старый номер
-        old_number = config['player_numbers'].get(игрок.id)
-        if old_number:
-            old_number_int = int(old_number)
-            if old_number_int in config['used_numbers']:
-                config['used_numbers'].remove(old_number_int)
+        if not interaction.guild:
+            await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
+            return
         
-        # Добавляем новый номер
-        config['used_numbers'].add(новый_номер)
-        config['player_numbers'][игрок.id] = formatted_number
+        async with guild_lock(interaction.guild.id):
+            config = get_guild_config(interaction.guild.id, interaction.guild.name)
+            
+            if игрок.id not in config['registered_players']:
+                await safe_edit_response(interaction, content="❌ Игрок не зарегистрирован")
+                return
+            
+            if новый_номер < config['min_number'] or новый_номер > config['max_number']:
+                await safe_edit_response(interaction, content=f"❌ Номер должен быть от {config['min_number']} до {config['max_number']}")
+                return
+            
+            # Номер занят другим игроком - не отдаем его второму
+            owner = config['player_numbers'].owner(новый_номер)
+            if owner is not None and owner != игрок.id:
+                await safe_edit_response(interaction, content=f"❌ Номер {format_number(новый_номер)} уже у <@{owner}>")
+                return
+            
+            formatted_number = format_number(новый_номер)
+            
+            # Освобождаем старый номер и занимаем новый
+            old_number = config['player_numbers'].get(игрок.id)
+            if old_number is not None:
+                config.release_number(old_number)
+            config.reserve_number(новый_номер)
+            config['player_numbers'][игрок.id] = новый_номер
+            config.mark_dirty('used_numbers', 'player_numbers')
+            PLAYER_SEARCH.add(interaction.guild, игрок.id, новый_номер)
         
         await save_data_with_backup(interaction.guild.id)
         
@@ -2341,6 +4906,104 @@ async def changenumber(interaction: discord.Interaction, игрок: discord.Mem
         logger.error(f"❌ Ошибка в команде changenumber: {e}")
         await safe_send_response(interaction, "❌ Произошла ошибка при изменении номера", ephemeral=True)
 
+@bot.tree.command(name="import_players", description="Массово зарегистрировать участников из файла (админы)")
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(файл="Текстовый/CSV файл: в каждой строке ID участника и, по желанию, номер")
+async def import_players_cmd(interaction: discord.Interaction, файл: discord.Attachment):
+    """Регистрирует участников списком: номера выдаются за один проход, роли и ники - в фоне"""
+    try:
+        await safe_defer_response(interaction, ephemeral=True)
+        
+        if not interaction.guild:
+            await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
+            return
+        
+        if not файл.filename.endswith(('.txt', '.csv')):
+            await safe_edit_response(interaction, content="❌ Загрузите файл .txt или .csv")
+            return
+        
+        try:
+            text = (await файл.read()).decode('utf-8-sig')
+        except UnicodeDecodeError:
+            await safe_edit_response(interaction, content="❌ Файл должен быть в кодировке UTF-8")
+            return
+        
+        entries, errors = parse_import_roster(text)
+        
+        # Регистрируем только тех, кто есть на сервере (участники кэшируются благодаря intents.members)
+        guild = interaction.guild
+        members = {}
+        known_entries = []
+        for user_id, number in entries:
+            member = guild.get_member(user_id)
+            if member is None:
+                errors.append(f"`{user_id}`: нет на сервере")
+                continue
+            members[user_id] = member
+            known_entries.append((user_id, number))
+        
+        async with guild_lock(guild.id):
+            config = get_guild_config(guild.id, guild.name)
+            imported, skipped = import_players(config, known_entries)
+            if imported:
+                PLAYER_SEARCH.invalidate(guild.id)
+        
+        errors.extend(f"`{user_id}`: {reason}" for user_id, reason in skipped)
+        
+        if imported:
+            # Одно сохранение на весь импорт
+            await save_data_with_backup(guild.id)
+            LEADERBOARDS.request(guild.id)
+        
+        def import_embed(status: str) -> discord.Embed:
+            embed = discord.Embed(
+                title="📥 ИМПОРТ УЧАСТНИКОВ",
+                description=status,
+                color=0xff0000
+            )
+            embed.add_field(name="✅ Зарегистрировано", value=f"```{len(imported)}```", inline=True)
+            embed.add_field(name="⚠️ Пропущено", value=f"```{len(errors)}```", inline=True)
+            embed.add_field(
+                name="👥 Участников",
+                value=f"```{len(config['registered_players'])}/{config['max_players']}```",
+                inline=True
+            )
+            if errors:
+                shown = "\n".join(f"• {error}" for error in errors[:10])
+                if len(errors) > 10:
+                    shown += f"\n... и еще {len(errors) - 10}"
+                embed.add_field(name="📋 Пропущенные строки", value=shown[:1024], inline=False)
+            embed.set_footer(text=f"Система регистрации • {guild.name}")
+            return embed
+        
+        if not imported:
+            await safe_edit_response(interaction, embed=import_embed("Никто не зарегистрирован"))
+            return
+        
+        await safe_edit_response(interaction, embed=import_embed(f"⏳ Выдаю роли и ники: 0/{len(imported)}"))
+        
+        async def report(done: int, total: int):
+            await safe_edit_response(interaction, embed=import_embed(f"⏳ Выдаю роли и ники: {done}/{total}"))
+        
+        counts = await REGISTRATIONS.apply_import(
+            guild,
+            [(members[user_id], number) for user_id, number in imported],
+            IMPORT_CONCURRENCY,
+            report
+        )
+        
+        status = f"✅ Роли и ники выданы: {counts['applied']}/{len(imported)}"
+        if counts['failed']:
+            status += f"\n❌ Не хватило прав для {counts['failed']} участников"
+        if counts['skipped']:
+            status += f"\n↩️ Сброшены во время импорта: {counts['skipped']}"
+        await safe_edit_response(interaction, embed=import_embed(status))
+        logger.info(f"📥 Импорт на сервере {guild.name}: зарегистрировано {len(imported)}, пропущено {len(errors)}")
+        
+    except Exception as e:
+        logger.error(f"❌ Ошибка в команде import_players: {e}")
+        await safe_send_response(interaction, "❌ Произошла ошибка при импорте участников", ephemeral=True)
+
 @bot.tree.command(name="backup", description="Создать резервную копию данных (админы)")
 @app_commands.default_permissions(administrator=True)
 async def backup(interaction: discord.Interaction):
@@ -2352,8 +5015,8 @@ async def backup(interaction: discord.Interaction):
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        # Создаем файл бэкапа
-        success = await send_backup_to_channel(interaction.guild.id)
+        # Ручной бэкап уходит сразу и всегда полный - с него можно восстановиться без дельт
+        success = await BACKUPS.backup_now(interaction.guild.id)
         
         if success:
             embed = discord.Embed(
@@ -2410,8 +5073,12 @@ async def set_backup_channel(interaction: discord.Interaction):
 
 @bot.tree.command(name="restore", description="Восстановить данные из резервной копии (админы)")
 @app_commands.default_permissions(administrator=True)
-async def restore(interaction: discord.Interaction, файл: discord.Attachment):
-    """Восстанавливает данные из файла резервной копии"""
+@app_commands.describe(
+    файл="Полный (базовый) бэкап",
+    дельта="Последний инкрементальный бэкап к этой базе (необязательно)"
+)
+async def restore(interaction: discord.Interaction, файл: discord.Attachment, дельта: Optional[discord.Attachment] = None):
+    """Восстанавливает данные из файла резервной копии (и, при наличии, дельты к нему)"""
     try:
         await safe_send_response(interaction, "🔄 Проверяю файл...", ephemeral=True)
         
@@ -2419,11 +5086,12 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        # Проверяем что файл JSON
-        if not файл.filename.endswith('.json'):
+        # Проверяем что файлы JSON (в том числе сжатые)
+        backup_extensions = ('.json', '.json.gz')
+        if not файл.filename.endswith(backup_extensions) or (дельта is not None and not дельта.filename.endswith(backup_extensions)):
             embed = discord.Embed(
                 title="❌ ОШИБКА ФОРМАТА",
-                description="Пожалуйста, загрузите файл в формате JSON",
+                description="Пожалуйста, загрузите файл в формате JSON (.json или .json.gz)",
                 color=0xff0000
             )
             await interaction.edit_original_response(embed=embed)
@@ -2433,8 +5101,9 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
         file_data = await файл.read()
         
         try:
-            backup_data = json.loads(file_data.decode('utf-8'))
-        except json.JSONDecodeError:
+            # Разбор большого файла не должен задерживать команды других серверов
+            backup_data = await asyncio.to_thread(decode_backup_file, file_data)
+        except (json.JSONDecodeError, UnicodeDecodeError, OSError, EOFError, zlib.error):
             embed = discord.Embed(
                 title="❌ ОШИБКА ЧТЕНИЯ",
                 description="Не удалось прочитать файл. Убедитесь, что это валидный JSON файл.",
@@ -2443,6 +5112,71 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
             await interaction.edit_original_response(embed=embed)
             return
         
+        # Данные не объектом JSON проверка ниже отклонит с понятной ошибкой
+        if not isinstance(backup_data, dict):
+            backup_data = {'config': backup_data}
+        
+        # Дельта сама по себе не восстанавливается - нужна база, к которой она построена
+        if backup_data.get('type') == 'delta':
+            embed = discord.Embed(
+                title="❌ ЭТО ИНКРЕМЕНТАЛЬНЫЙ БЭКАП",
+                description=(
+                    "Этот файл содержит только изменения.\n"
+                    f"Прикрепите в `файл` базовый бэкап `{backup_data.get('base_id', '?')}`, "
+                    "а этот файл - в `дельта`."
+                ),
+                color=0xff0000
+            )
+            await interaction.edit_original_response(embed=embed)
+            return
+        
+        if дельта is not None:
+            try:
+                delta_data = await asyncio.to_thread(decode_backup_file, await дельта.read())
+            except (json.JSONDecodeError, UnicodeDecodeError, OSError, EOFError, zlib.error):
+                delta_data = None
+            
+            if not isinstance(delta_data, dict) or delta_data.get('type') != 'delta' or not isinstance(delta_data.get('changes'), dict):
+                embed = discord.Embed(
+                    title="❌ ОШИБКА ЧТЕНИЯ",
+                    description="Файл в поле `дельта` не является инкрементальным бэкапом.",
+                    color=0xff0000
+                )
+                await interaction.edit_original_response(embed=embed)
+                return
+            
+            if 'config' not in backup_data or delta_data.get('base_id') != backup_data.get('backup_id'):
+                embed = discord.Embed(
+                    title="❌ ДЕЛЬТА НЕ ПОДХОДИТ",
+                    description=(
+                        "Дельта построена к другому базовому бэкапу.\n"
+                        f"• База дельты: `{delta_data.get('base_id', '?')}`\n"
+                        f"• Загруженная база: `{backup_data.get('backup_id', 'без ID')}`"
+                    ),
+                    color=0xff0000
+                )
+                await interaction.edit_original_response(embed=embed)
+                return
+            
+            backup_data = dict(
+                backup_data,
+                config=apply_backup_delta(backup_data['config'], delta_data['changes']),
+                backup_timestamp=delta_data.get('backup_timestamp', backup_data.get('backup_timestamp')),
+                config_sha256=delta_data.get('config_sha256')
+            )
+            logger.info(f"📦 К базе {backup_data['backup_id']} применена дельта #{delta_data.get('seq')}")
+        
+        # Бэкапы с хэшем проверяем: после применения дельты данные должны совпасть с исходными
+        expected_hash = backup_data.get('config_sha256') if isinstance(backup_data.get('config'), dict) else None
+        if expected_hash and backup_config_hash(backup_data['config']) != expected_hash:
+            embed = discord.Embed(
+                title="❌ КОНТРОЛЬНАЯ СУММА НЕ СОВПАДАЕТ",
+                description="Данные бэкапа повреждены или изменены вручную (SHA-256 не совпадает).",
+                color=0xff0000
+            )
+            await interaction.edit_original_response(embed=embed)
+            return
+        
         # ОТЛАДОЧНАЯ ИНФОРМАЦИЯ: выводим все ключи для диагностики
         logger.info(f"🔍 Ключи в backup_data: {list(backup_data.keys())}")
         
@@ -2458,30 +5192,15 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
             config_data = backup_data
             logger.info("📁 Используется старый формат бэкапа (данные в корне)")
         
-        # ОТЛАДОЧНАЯ ИНФОРМАЦИЯ: выводим ключи config_data
-        logger.info(f"🔍 Ключи в config_data: {list(config_data.keys())}")
-        
-        # Проверяем обязательные поля с более гибкой логикой
-        required_fields = ['used_numbers', 'registered_players', 'player_numbers', 'player_titles']
-        missing_fields = []
+        # Проверяем все поля сразу (в потоке) и показываем все найденные проблемы
+        _, errors = await asyncio.to_thread(validate_backup_config, config_data)
         
-        for field in required_fields:
-            if field not in config_data:
-                missing_fields.append(field)
-        
-        # Если есть отсутствующие поля, показываем подробную ошибку
-        if missing_fields:
-            # Создаем подробное сообщение об ошибке
-            error_details = []
-            for field in required_fields:
-                status = "✅ ЕСТЬ" if field in config_data else "❌ ОТСУТСТВУЕТ"
-                error_details.append(f"{status} {field}")
-            
+        if errors:
             embed = discord.Embed(
                 title="❌ НЕВЕРНЫЙ ФОРМАТ ФАЙЛА",
                 description=(
-                    "Файл бэкапа имеет несовместимый формат.\n\n"
-                    "**Проверка полей:**\n" + "\n".join(error_details) + "\n\n"
+                    "Файл бэкапа не прошел проверку, данные не изменены.\n\n"
+                    f"**Найдено проблем: {len(errors)}**\n" + format_restore_errors(errors) + "\n\n"
                     "**Возможные причины:**\n"
                     "• Файл создан в старой версии бота\n"
                     "• Файл был изменен вручную\n"
@@ -2500,8 +5219,7 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
             await interaction.edit_original_response(embed=embed)
             return
         
-        # Если все поля присутствуют, продолжаем
-        logger.info("✅ Все обязательные поля присутствуют в бэкапе")
+        logger.info("✅ Бэкап прошел проверку")
         
         # Предупреждение о перезаписи
         warning_embed = discord.Embed(
@@ -2595,11 +5313,14 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
                     await interaction.response.edit_message(embed=restoring_embed, view=None)
                     
                     # Восстанавливаем данные
-                    success = await restore_from_backup(self.config_data, self.guild_id)
+                    report = await restore_from_backup(self.config_data, self.guild_id)
+                    timings_text = "\n".join(
+                        f"• {phase}: {seconds * 1000:.1f} мс" for phase, seconds in report['timings'].items()
+                    ) or "—"
                     
-                    if success:
+                    if report['success']:
                         # Обновляем лидерборд
-                        asyncio.create_task(auto_update_leaderboard(self.guild_id))
+                        LEADERBOARDS.request(self.guild_id)
                         
                         config = get_guild_config(self.guild_id)
                         
@@ -2633,6 +5354,11 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
                             inline=False
                         )
                         
+                        success_embed.add_field(name="⏱️ ВРЕМЯ ЭТАПОВ", value=timings_text, inline=False)
+                        
+                        if report['errors']:
+                            success_embed.add_field(name="⚠️ ПРЕДУПРЕЖДЕНИЯ", value=format_restore_errors(report['errors']), inline=False)
+                        
                         success_embed.set_footer(text=f"Восстановлено • {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
                         
                         await interaction.edit_original_response(embed=success_embed)
@@ -2641,9 +5367,13 @@ async def restore(interaction: discord.Interaction, файл: discord.Attachment
                     else:
                         error_embed = discord.Embed(
                             title="❌ ОШИБКА ВОССТАНОВЛЕНИЯ",
-                            description="Не удалось восстановить данные из файла. Проверьте лог для подробностей.",
+                            description=(
+                                "Не удалось восстановить данные из файла, текущие данные не изменены.\n\n"
+                                + format_restore_errors(report['errors'])
+                            ),
                             color=0xff0000
                         )
+                        error_embed.add_field(name="⏱️ ВРЕМЯ ЭТАПОВ", value=timings_text, inline=False)
                         await interaction.edit_original_response(embed=error_embed)
                     
                 except Exception as e:
@@ -2738,38 +5468,46 @@ async def players_list(interaction: discord.Interaction):
         total_players = len(config['registered_players'])
         available_spots = config['max_players'] - total_players
         
-        embed = discord.Embed(
-            title="👥 УЧАСТНИКИ",
-            color=0xff0000
-        )
-        embed.add_field(
-            name="🎯 Зарегистрировано",
-            value=f"```{total_players}/{config['max_players']} игроков```",
-            inline=True
-        )
-        embed.add_field(
-            name="🎫 Свободно мест",
-            value=f"```{available_spots}```",
-            inline=True
-        )
-        
-        if total_players > 0:
-            # Показываем только первые 10 игроков
-            players_list = []
-            count = 0
-            for user_id in list(config['registered_players'])[:10]:
-                user = bot.get_user(user_id)
-                player_number = config['player_numbers'].get(user_id, "???")
-                if user:
-                    players_list.append(f"• {user.display_name} ({player_number})")
-                    count += 1
+        def build_embed():
+            embed = discord.Embed(
+                title="👥 УЧАСТНИКИ",
+                color=0xff0000
+            )
+            embed.add_field(
+                name="🎯 Зарегистрировано",
+                value=f"```{total_players}/{config['max_players']} игроков```",
+                inline=True
+            )
+            embed.add_field(
+                name="🎫 Свободно мест",
+                value=f"```{available_spots}```",
+                inline=True
+            )
             
-            if players_list:
-                embed.add_field(
-                    name=f"🎮 Игроки (первые {count})",
-                    value="\n".join(players_list),
-                    inline=False
-                )
+            if total_players > 0:
+                # Показываем только первые 10 игроков
+                players_list = []
+                count = 0
+                for user_id in list(config['registered_players'])[:10]:
+                    user = bot.get_user(user_id)
+                    player_number = format_number(config['player_numbers'].get(user_id))
+                    if user:
+                        players_list.append(f"• {user.display_name} ({player_number})")
+                        count += 1
+                    else:
+                        unknown.append(user_id)
+            
+                if players_list:
+                    embed.add_field(
+                        name=f"🎮 Игроки (первые {count})",
+                        value="\n".join(players_list),
+                        inline=False
+                    )
+            return embed
+        
+        # Пропущенные из-за кэша Discord игроки появятся позже - такой embed не запоминаем
+        unknown = []
+        embed = await RENDERS.render(interaction.guild.id, 'players_list', 1, config, build_embed, cacheable=lambda: not unknown)
         
         await safe_edit_response(interaction, embed=embed)
         
@@ -2798,12 +5536,18 @@ async def mynumber(interaction: discord.Interaction):
             await safe_edit_response(interaction, embed=embed)
             return
         
-        player_number = config['player_numbers'].get(interaction.user.id, "???")
+        player_number = format_number(config['player_numbers'].get(interaction.user.id))
         embed = discord.Embed(
             title="🎫 ВАШ НОМЕР",
             description=f"**Ваш игровой номер:** `{player_number}`",
             color=0xff0000
         )
+        if interaction.user.id in config['registration_order']:
+            embed.add_field(
+                name="📊 Место в порядке регистрации",
+                value=f"`#{config['registration_order'].index(interaction.user.id) + 1}` из {len(config['registration_order'])}",
+                inline=False
+            )
         embed.add_field(
             name="💡 Информация",
             value="Этот номер будет вашим идентификатором во время события",
@@ -2846,7 +5590,7 @@ async def list_cmd(interaction: discord.Interaction):
         players_list = []
         for user_id in config['registered_players']:
             user = bot.get_user(user_id)
-            player_number = config['player_numbers'].get(user_id, "???")
+            player_number = format_number(config['player_numbers'].get(user_id))
             if user:
                 players_list.append(f"• {user.display_name} ({player_number})")
             else:
@@ -2894,7 +5638,7 @@ async def save_cmd(interaction: discord.Interaction):
         
         config = get_guild_config(interaction.guild.id, interaction.guild.name)
         
-        if await save_data_with_backup(interaction.guild.id):
+        if await save_data_with_backup(interaction.guild.id, wait=True):
             embed = discord.Embed(
                 title="💾 ДАННЫЕ СОХРАНЕНЫ",
                 description="Все данные игры успешно сохранены",
@@ -2930,6 +5674,9 @@ async def load_cmd(interaction: discord.Interaction):
     try:
         await safe_defer_response(interaction, ephemeral=True)
         
+        # Дописываем отложенные сохранения, чтобы не читать файл во время записи
+        await PERSISTENCE.flush()
+        
         if load_data():
             config = get_guild_config(interaction.guild.id, interaction.guild.name)
             embed = discord.Embed(
@@ -2987,40 +5734,40 @@ async def reset(interaction: discord.Interaction, игрок: discord.Member):
             await safe_edit_response(interaction, content="❌ Эта команда работает только на сервере")
             return
         
-        config = get_guild_config(interaction.guild.id, interaction.guild.name)
+        async with guild_lock(interaction.guild.id):
+            config = get_guild_config(interaction.guild.id, interaction.guild.name)
+                
+            if игрок.id not in config['registered_players']:
+                embed = discord.Embed(
+                    title="❌ Ошибка",
+                    description=f"{игрок.mention} не зарегистрирован в системе",
+                    color=0xff0000
+                )
+                embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
+                await safe_edit_response(interaction, embed=embed)
+                return
             
-        if игрок.id not in config['registered_players']:
-            embed = discord.Embed(
-                title="❌ Ошибка",
-                description=f"{игрок.mention} не зарегистрирован в системе",
-                color=0xff0000
-            )
-            embed.set_thumbnail(url="https://media.discordapp.net/attachments/1420114175895666759/1433470801197404160/download-Photoroom.png?ex=6904cf37&is=69037db7&hm=e1efd6926b779844a323f067c700d584a49945758839a19b4c6e8c0a34f2b44e&=&format=webp&quality=lossless")
-            await safe_edit_response(interaction, embed=embed)
-            return
-        
-        # Удаляем номер из использованных
-        player_number = config['player_numbers'].get(игрок.id)
-        if player_number:
-            number_int = int(player_number)
-            if number_int in config['used_numbers']:
-                config['used_numbers'].remove(number_int)
-        
-        # Удаляем игрока из зарегистрированных
-        config['registered_players'].discard(игрок.id)
-        config['player_numbers'].pop(игрок.id, None)
-        # УДАЛЯЕМ ИЗ ПОРЯДКА РЕГИСТРАЦИИ
-        if игрок.id in config['registration_order']:
-            config['registration_order'].remove(игрок.id)
+            # Удаляем номер из использованных
+            player_number = config['player_numbers'].pop(игрок.id, None)
+            if player_number is not None:
+                config.release_number(player_number)
+            
+            # Удаляем игрока из зарегистрированных
+            config['registered_players'].discard(игрок.id)
+            PLAYER_SEARCH.remove(interaction.guild.id, игрок.id)
+            # УДАЛЯЕМ ИЗ ПОРЯДКА РЕГИСТРАЦИИ
+            if игрок.id in config['registration_order']:
+                config['registration_order'].remove(игрок.id)
+            config.mark_dirty('used_numbers', 'registered_players', 'player_numbers', 'registration_order')
         
         # Сохраняем изменения
         await save_data_with_backup(interaction.guild.id)
         
         # АВТОМАТИЧЕСКОЕ ОБНОВЛЕНИЕ ЛИДЕРБОРДА ПРИ УДАЛЕНИИ ИГРОКА
-        asyncio.create_task(auto_update_leaderboard(interaction.guild.id))
+        LEADERBOARDS.request(interaction.guild.id)
         
         # Убираем роль
-        registration_role = discord.utils.get(interaction.guild.roles, name=config['registration_role_name'])
+        registration_role = GUILD_OBJECTS.registration_role(interaction.guild, config)
         if registration_role and registration_role in игрок.roles:
             try:
                 await игрок.remove_roles(registration_role)
@@ -3089,14 +5836,17 @@ async def on_ready():
     logger.info(f'✅ Бот {bot.user} запущен!')
     logger.info(f'🆔 ID бота: {bot.user.id}')
     
-    # Загружаем данные из файла
-    load_data()
+    # Старый формат данных переносится, только когда известны серверы - сразу сохраняем в новом
+    if attach_legacy_data():
+        await save_data()
     
     # Восстанавливаем игроков из ролей на всех серверах
     for guild in bot.guilds:
         logger.info(f"🔍 Проверка сервера: {guild.name} ({guild.id})")
         config = get_guild_config(guild.id, guild.name)
         await restore_players_from_roles(guild, config)
+        # Регистрации, не примененные до перезапуска, догоняем в фоне
+        REGISTRATIONS.reconcile(guild, config)
     
     # Статистика по серверам
     for guild_id, config in GUILD_DATA.items():
@@ -3111,9 +5861,244 @@ async def on_ready():
     except Exception as e:
         logger.error(f"❌ Ошибка синхронизации команд: {e}")
 
+@bot.event
+async def on_guild_role_update(before, after):
+    GUILD_OBJECTS.forget_role(after)
+
+@bot.event
+async def on_guild_role_delete(role):
+    GUILD_OBJECTS.forget_role(role)
+    config = GUILD_DATA.get(role.guild.id)
+    if config is not None and config['registration_role_id'] == role.id:
+        # Роль удалена - при следующей регистрации найдем по имени или создадим заново
+        config['registration_role_id'] = None
+        request_save(role.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    GUILD_OBJECTS.forget_channel(channel.id)
+
+@bot.event
+async def on_member_update(before, after):
+    if before.display_name != after.display_name:
+        PLAYER_SEARCH.rename(after)
+        # Ник игрока виден в лидерборде и списке участников
+        config = GUILD_DATA.get(after.guild.id)
+        if config is not None and after.id in config['registered_players']:
+            RENDERS.invalidate(after.guild.id)
+
+@bot.event
+async def on_user_update(before, after):
+    # Лидерборд и список участников показывают имя пользователя, а не только ник на сервере
+    if before.display_name != after.display_name:
+        for guild_id, config in GUILD_DATA.items():
+            if after.id in config['registered_players']:
+                RENDERS.invalidate(guild_id)
+
+def benchmark_startup(guild_counts=(10, 100, 1000), players_per_guild: int = 90, repeats: int = 5):
+    """Сравнивает время загрузки JSON и бинарного снапшота (python inkgame.py bench-startup)"""
+    saved_guilds = dict(GUILD_DATA)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            print(f"{'Серверов':>9} | {'JSON, мс':>9} | {'binary, мс':>10} | {'JSON, КБ':>9} | {'binary, КБ':>10}")
+            for count in guild_counts:
+                GUILD_DATA.clear()
+                for guild_id in range(1, count + 1):
+                    config = GuildState(f"Bench {guild_id}")
+                    for index in range(players_per_guild):
+                        user_id = 10 ** 17 + guild_id * 1000 + index
+                        config['used_numbers'].add(index + 1)
+                        config['registered_players'].add(user_id)
+                        config['player_numbers'][user_id] = index + 1
+                        config['registration_order'].append(user_id)
+                        if index % 5 == 0:
+                            config['player_titles'][user_id] = {'owned': ['EchoFan', 'Legend'], 'equipped': 'Legend'}
+                    GUILD_DATA[guild_id] = config
+
+                row = []
+                for snapshot_format in ('json', 'binary'):
+                    storage = JsonStorage(os.path.join(directory, f"bench_{count}_{snapshot_format}.json"), snapshot_format)
+                    storage.save()
+                    best = None
+                    for _ in range(repeats):
+                        started = time.perf_counter()
+                        data = storage.load()
+                        for config in data['guilds'].values():
+                            GuildState.from_dict(config)
+                        elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+                    path = storage.binary_path if snapshot_format == 'binary' else storage.path
+                    row.append((best * 1000, os.path.getsize(path) / 1024))
+
+                print(f"{count:>9} | {row[0][0]:>9.1f} | {row[1][0]:>10.1f} | {row[0][1]:>9.0f} | {row[1][1]:>10.0f}")
+    finally:
+        GUILD_DATA.clear()
+        GUILD_DATA.update(saved_guilds)
+
+def benchmark_number_allocation(sizes=(456, 10000, 100000), bands=((0.0, 0.5), (0.5, 0.9), (0.9, 0.99), (0.99, 1.0))):
+    """Среднее время выдачи номера по мере заполнения диапазона (python inkgame.py bench-numbers)
+
+    Сравнивает NumberAllocator со старым циклом random.randint до свободного номера.
+    """
+    def rejection_loop(config):
+        while True:
+            number = random.randint(config['min_number'], config['max_number'])
+            if number not in config['used_numbers']:
+                config['used_numbers'].add(number)
+                return number
+
+    print(f"{'Диапазон':>9} | {'Заполнение':>10} | {'allocator, мкс':>14} | {'randint-цикл, мкс':>17}")
+    for size in sizes:
+        results = []
+        for allocate in (GuildState.allocate_number, rejection_loop):
+            config = GuildState("Bench")
+            config['min_number'], config['max_number'] = 1, size
+            timings = []
+            for start, end in bands:
+                count = int(size * end) - int(size * start)
+                started = time.perf_counter()
+                for _ in range(count):
+                    allocate(config)
+                timings.append((time.perf_counter() - started) / max(count, 1) * 1e6)
+            assert len(config['used_numbers']) == size
+            results.append(timings)
+
+        for index, (start, end) in enumerate(bands):
+            band = f"{start:.0%}-{end:.0%}"
+            print(f"{size:>9} | {band:>10} | {results[0][index]:>14.2f} | {results[1][index]:>17.2f}")
+
+def benchmark_registration_burst(requests: int = 500, guilds: int = 4, round_trip: float = 0.02):
+    """Нагрузочный тест: одновременные /reg на нескольких серверах (python inkgame.py bench-reg)
+
+    Каждый запрос ждет случайную часть round_trip (defer), регистрируется под блокировкой
+    сервера и ждет round_trip на ответ. Для сравнения тот же admit_player без блокировки:
+    он не ждет между проверкой и записью, так что разница - только цена самой блокировки.
+    """
+    async def burst(locked: bool):
+        states = {guild_id: GuildState(f"Bench {guild_id}") for guild_id in range(-guilds, 0)}
+        for config in states.values():
+            config['registration_open'] = True
+        latencies = []
+
+        async def register(guild_id: int, user_id: int):
+            started = time.perf_counter()
+            await asyncio.sleep(random.uniform(0, round_trip))
+            config = states[guild_id]
+            if locked:
+                async with guild_lock(guild_id):
+                    admit_player(config, user_id)
+            else:
+                admit_player(config, user_id)
+            await asyncio.sleep(round_trip)
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            register(guild_id, user_id) for guild_id in states for user_id in range(1, requests + 1)
+        ))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        counts = [len(config['registered_players']) for config in states.values()]
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        mode = "с блокировкой" if locked else "без блокировки"
+        print(
+            f"{mode:>15} | зарегистрировано {counts} из {requests} (лимит {DEFAULT_CONFIG['max_players']}) | "
+            f"p50 {p50:.1f} мс, p99 {p99:.1f} мс, всего {elapsed * 1000:.0f} мс"
+        )
+        for guild_id in states:
+            GUILD_LOCKS.pop(guild_id, None)
+
+    print(f"{guilds} сервера x {requests} одновременных /reg, задержка Discord {round_trip * 1000:.0f} мс")
+    asyncio.run(burst(locked=False))
+    asyncio.run(burst(locked=True))
+
+def benchmark_registration_ack(requests: int = 300, holders: int = 2, span: float = 6.0, hold: float = 1.0, round_trip: float = 0.05):
+    """Время первого ответа /reg, пока долгие команды держат блокировку (python inkgame.py bench-ack)
+
+    За span секунд приходят requests регистраций и holders команд, которые держат блокировку
+    сервера hold секунд (как /restore). Сравниваются: всегда defer; быстрый ответ с
+    проверкой lock.locked(); быстрый ответ с ожиданием блокировки не дольше REG_ACK_LOCK_WAIT.
+    """
+    async def run(mode: str):
+        config = GuildState("Bench ack")
+        config['registration_open'] = True
+        config['max_players'] = requests
+        lock = asyncio.Lock()
+        first_response = []
+        number_shown = []
+        deferred = 0
+
+        async def holder():
+            await asyncio.sleep(random.uniform(0, span))
+            async with lock:
+                await asyncio.sleep(hold)
+
+        async def register(user_id: int):
+            nonlocal deferred
+            await asyncio.sleep(random.uniform(0, span))
+            started = time.perf_counter()
+            acked = None
+
+            async def defer():
+                nonlocal acked, deferred
+                await asyncio.sleep(round_trip)
+                acked = time.perf_counter()
+                deferred += 1
+
+            if mode == 'defer' or (mode == 'locked()' and lock.locked()):
+                await defer()
+                await lock.acquire()
+            elif mode == 'locked()':
+                await lock.acquire()
+            else:
+                await acquire_or_defer(lock, defer, REG_ACK_LOCK_WAIT)
+            try:
+                admit_player(config, user_id)
+            finally:
+                lock.release()
+            await asyncio.sleep(round_trip)
+            first_response.append((acked or time.perf_counter()) - started)
+            number_shown.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(holder() for _ in range(holders)), *(register(user_id) for user_id in range(1, requests + 1)))
+        first_response.sort()
+        number_shown.sort()
+        p50 = first_response[len(first_response) // 2] * 1000
+        p99 = first_response[int(len(first_response) * 0.99)] * 1000
+        late = sum(1 for seconds in first_response if seconds > 3)
+        print(
+            f"{mode:>9} | первый ответ p50 {p50:.0f} мс, p99 {p99:.0f} мс, max {first_response[-1] * 1000:.0f} мс | "
+            f"позже 3 с: {late} | номер p50 {number_shown[len(number_shown) // 2] * 1000:.0f} мс | "
+            f"defer: {deferred}/{requests}"
+        )
+
+    print(
+        f"{requests} /reg и {holders} команд, держащих блокировку {hold:.1f} с, за {span:.0f} с; "
+        f"задержка Discord {round_trip * 1000:.0f} мс, ожидание блокировки {REG_ACK_LOCK_WAIT * 1000:.0f} мс"
+    )
+    for mode in ('defer', 'locked()', 'wait_for'):
+        random.seed(0)
+        asyncio.run(run(mode))
+
 # Запуск бота
 if __name__ == "__main__":
-    bot.run(DISCORD_TOKEN)
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate-sqlite':
+        # python inkgame.py migrate-sqlite [game_data.json] [game_data.db]
+        source = sys.argv[2] if len(sys.argv) > 2 else DATA_FILE
+        target = sys.argv[3] if len(sys.argv) > 3 else SQLITE_FILE
+        migrated = migrate_json_to_sqlite(source, target)
+        logger.info(f"✅ Перенесено серверов в {target}: {migrated}")
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bench-startup':
+        benchmark_startup()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bench-numbers':
+        benchmark_number_allocation()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bench-reg':
+        benchmark_registration_burst()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'bench-ack':
+        benchmark_registration_ack()
+    else:
+        bot.run(DISCORD_TOKEN)
 
 
 